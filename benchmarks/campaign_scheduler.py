@@ -0,0 +1,115 @@
+"""Benchmark: CampaignScheduler vs. filtering and sorting the whole inventory per call.
+
+Usage: python -m benchmarks.campaign_scheduler [campaigns]
+"""
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from types import SimpleNamespace
+
+from core.channel import Channel
+from core.constants import PriorityMode
+from core.inventory import DropsCampaign
+from core.scheduler import CampaignScheduler, SCHEDULED_MODES
+from core.utils import Game
+
+GAMES = 50
+
+
+def _iso(when: datetime) -> str:
+    return when.isoformat().replace("+00:00", "Z")
+
+
+def synthetic_campaigns(count: int, seed: int = 1) -> list[DropsCampaign]:
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    campaigns = []
+    for c in range(count):
+        starts_at = now - timedelta(days=rng.randint(0, 20))
+        ends_at = now + timedelta(hours=rng.randint(1, 24 * 20))
+        restricted = rng.random() < 0.2
+        game = rng.randrange(GAMES)
+        campaigns.append(DropsCampaign(None, {
+            "id": f"campaign-{c}",
+            "name": f"Campaign {c}",
+            "game": {"id": str(game), "name": f"Game {game}"},
+            "startAt": _iso(starts_at),
+            "endAt": _iso(ends_at),
+            "self": {"isAccountConnected": rng.random() < 0.95},
+            "allow": {
+                "isEnabled": restricted,
+                "channels": [{"id": str(rng.randrange(200))} for _ in range(5)] if restricted else None,
+            },
+            "timeBasedDrops": [
+                {
+                    "id": f"drop-{c}-{d}",
+                    "name": f"Drop {d}",
+                    "startAt": _iso(starts_at),
+                    "endAt": _iso(ends_at),
+                    "requiredMinutesWatched": 60 * (d + 1),
+                    "self": {"currentMinutesWatched": rng.randint(0, 60 * (d + 1))},
+                }
+                for d in range(3)
+            ],
+        }))
+    return campaigns
+
+
+def legacy_active_campaign(inventory: list[DropsCampaign], channel: Channel, settings) -> DropsCampaign:
+    """The selection as get_active_campaign used to do it."""
+    available = [c for c in inventory if c.can_earn(channel)]
+    if not available:
+        return None
+    if settings.priority_mode == PriorityMode.ENDING_SOONEST:
+        available.sort(key=lambda c: c.ends_at)
+    elif settings.priority_mode == PriorityMode.LOW_AVAILABILITY:
+        available.sort(key=lambda c: c.availability)
+    else:
+        def priority_key(campaign):
+            try:
+                return settings.priority.index(campaign.game.name)
+            except ValueError:
+                return 999999
+        available.sort(key=priority_key)
+    return available[0]
+
+
+def run(count: int, queries: int = 2000):
+    inventory = synthetic_campaigns(count)
+    settings = SimpleNamespace(
+        priority=[f"Game {g}" for g in random.Random(2).sample(range(GAMES), GAMES // 2)],
+        priority_mode=PriorityMode.PRIORITY_ONLY,
+    )
+    rng = random.Random(3)
+    channels = []
+    for i in range(queries):
+        channel = Channel(None, rng.randrange(200), f"channel{i}", f"Channel{i}")
+        game = rng.randrange(GAMES)
+        channel.game = Game({"id": str(game), "name": f"Game {game}"})
+        channels.append(channel)
+
+    start = perf_counter()
+    scheduler = CampaignScheduler(settings)
+    scheduler.rebuild(inventory)
+    build = perf_counter() - start
+    print(f"{count} campaigns, {queries} queries per mode (scheduler build: {build * 1000:.1f} ms)")
+
+    for mode in SCHEDULED_MODES:
+        settings.priority_mode = mode
+        start = perf_counter()
+        expected = [legacy_active_campaign(inventory, channel, settings) for channel in channels]
+        legacy = perf_counter() - start
+
+        start = perf_counter()
+        got = [scheduler.best(channel) for channel in channels]
+        indexed = perf_counter() - start
+
+        mismatches = sum(1 for e, g in zip(expected, got) if e is not g)
+        print(f"  {mode.value:17s} sort: {legacy / queries * 1e6:9.1f} us/query, "
+              f"scheduler: {indexed / queries * 1e6:6.1f} us/query "
+              f"({legacy / indexed:6.1f}x), mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
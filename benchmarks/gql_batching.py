@@ -0,0 +1,91 @@
+"""Benchmark: batched vs. unbatched GQL requests against a local fake GQL server.
+
+Usage: python -m benchmarks.gql_batching [operations]
+"""
+import asyncio
+import sys
+from time import perf_counter
+
+import aiohttp
+from aiohttp import web
+
+from core.constants import GQL_OPERATIONS, GQLOperation
+from core.gql import GQLBatcher
+from core.proxy import ProxyPool
+
+
+class FakeGQLServer:
+    """Minimal stand-in for gql.twitch.tv that answers single and array requests."""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.requests = 0
+        self.url = ""
+        self._runner: web.AppRunner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        body = await request.json()
+        await asyncio.sleep(self.latency)
+        if isinstance(body, list):
+            return web.json_response([{"data": {"echo": op["variables"]}} for op in body])
+        return web.json_response({"data": {"echo": body["variables"]}})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/gql", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/gql"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+class _SessionHolder:
+    """Provides the parts of the TwitchClient interface GQLBatcher uses."""
+
+    def __init__(self, session: aiohttp.ClientSession):
+        self._session = session
+        self.proxy_pool = ProxyPool(self)
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        return self._session
+
+
+def _operation(i: int) -> GQLOperation:
+    return GQL_OPERATIONS["GetDirectory"].with_variables({"slug": f"game-{i}"})
+
+
+async def run(operations: int):
+    server = FakeGQLServer()
+    await server.start()
+    async with aiohttp.ClientSession() as session:
+        # Unbatched: one POST per operation, like the original gql_request
+        async def single(i: int):
+            async with session.post(server.url, data=_operation(i).payload, headers=GQLBatcher.HEADERS) as response:
+                return await response.json()
+
+        server.requests = 0
+        start = perf_counter()
+        await asyncio.gather(*(single(i) for i in range(operations)))
+        unbatched = (server.requests, perf_counter() - start)
+
+        batcher = GQLBatcher(_SessionHolder(session), url=server.url)
+        server.requests = 0
+        start = perf_counter()
+        await asyncio.gather(*(batcher.request(_operation(i)) for i in range(operations)))
+        batched = (server.requests, perf_counter() - start)
+        await batcher.close()
+    await server.stop()
+
+    print(f"{operations} concurrent operations")
+    print(f"  unbatched: {unbatched[0]:4d} requests, {unbatched[1] * 1000:8.1f} ms")
+    print(f"  batched:   {batched[0]:4d} requests, {batched[1] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
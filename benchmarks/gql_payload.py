@@ -0,0 +1,59 @@
+"""Micro-benchmark: GQL payload build time, mutable dict copies vs. precompiled templates.
+
+Usage: python -m benchmarks.gql_payload [iterations]
+"""
+import copy
+import json
+import sys
+from timeit import timeit
+
+from core.constants import GQL_OPERATIONS
+
+# The GetDirectory operation as it was defined before templates
+LEGACY_DIRECTORY = {
+    "operationName": "DirectoryPage_Game",
+    "extensions": {
+        "persistedQuery": {
+            "version": 1,
+            "sha256Hash": GQL_OPERATIONS["GetDirectory"].sha256,
+        }
+    },
+    "variables": {
+        "limit": 30,
+        "slug": "",
+        "options": {
+            "includeRestricted": ["SUB_ONLY_LIVE"],
+            "systemFilters": ["DROPS_ENABLED"]
+        }
+    },
+}
+
+
+def legacy_build(slug: str) -> bytes:
+    # Copy the operation so nothing shared is mutated, then encode the whole payload
+    operation = copy.deepcopy(LEGACY_DIRECTORY)
+    operation["variables"]["slug"] = slug
+    payload = {
+        "operationName": operation["operationName"],
+        "extensions": operation["extensions"],
+        "variables": operation.get("variables", {})
+    }
+    return json.dumps(payload).encode()
+
+
+def template_build(slug: str) -> bytes:
+    return GQL_OPERATIONS["GetDirectory"].with_variables({"slug": slug}).payload
+
+
+def run(iterations: int):
+    assert json.loads(legacy_build("x")) == json.loads(template_build("x"))
+    legacy = timeit(lambda: legacy_build("some-game"), number=iterations)
+    template = timeit(lambda: template_build("some-game"), number=iterations)
+    print(f"{iterations} payload builds")
+    print(f"  dict copy + dumps: {legacy / iterations * 1e6:7.2f} us/op")
+    print(f"  template:          {template / iterations * 1e6:7.2f} us/op")
+    print(f"  speedup:           {legacy / template:7.2f}x")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,114 @@
+"""Benchmark: bytes per watched hour of minute-watched beacons, batched vs. one request each.
+
+Runs against a local stand-in for the spade endpoint, with the minute shortened.
+
+Usage: python -m benchmarks.heartbeat [sessions] [minutes]
+"""
+import asyncio
+import base64
+import json
+import sys
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+from core.channel import Channel
+from core.heartbeat import HeartbeatEngine
+from core.proxy import ProxyPool
+
+TICK = 0.05
+
+
+class FakeSpadeServer:
+    """Accepts beacon batches like spade.twitch.tv does, with an empty 204."""
+
+    def __init__(self):
+        self.requests = 0
+        self.events = 0
+        self.url = ""
+        self._runner: web.AppRunner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        form = await request.post()
+        self.events += len(json.loads(base64.b64decode(form["data"])))
+        return web.Response(status=204)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/track", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/track"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+class _SessionHolder:
+    """Provides the parts of the TwitchClient interface HeartbeatEngine uses."""
+
+    def __init__(self, session: aiohttp.ClientSession):
+        self._session = session
+        self.settings = SimpleNamespace(user_id="123456789")
+        self.proxy_pool = ProxyPool(self)
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        return self._session
+
+
+def _channel(i: int) -> Channel:
+    channel = Channel(None, 1000 + i, f"streamer{i}", f"Streamer{i}")
+    channel.broadcast_id = f"4{i:010d}"
+    return channel
+
+
+async def _watch(engine: HeartbeatEngine, sessions: int, minutes: int, staggered: bool):
+    async def session(channel: Channel, offset: float):
+        await asyncio.sleep(offset)
+        for _ in range(minutes):
+            await engine.beat(channel)
+            if staggered:
+                await asyncio.sleep(engine.interval)
+            else:
+                await engine.wait_tick()
+
+    # Staggered sessions keep their own timers and never share a request, like independent loops would
+    await asyncio.gather(*(
+        session(_channel(i), TICK * i / sessions if staggered else 0) for i in range(sessions)
+    ))
+
+
+async def run(sessions: int, minutes: int):
+    server = FakeSpadeServer()
+    await server.start()
+    async with aiohttp.ClientSession() as session:
+        print(f"{sessions} sessions, {minutes} watched minutes each")
+        for name, staggered in (("one request each", True), ("batched", False)):
+            server.requests = 0
+            engine = HeartbeatEngine(_SessionHolder(session), url=server.url)
+            engine.interval = TICK
+            engine.window = TICK / 10
+            await _watch(engine, sessions, minutes, staggered)
+            await engine.close()
+            # Account in real minutes, the shortened tick stands for one
+            hours = engine.beacons_sent / 60
+            total = engine.bytes_sent + engine.bytes_received
+            print(
+                f"  {name:16s} {server.requests:5d} requests, {server.events:5d} beacons, "
+                f"{total / hours / 1024:7.1f} KiB per watched hour, "
+                f"{server.requests / hours:5.1f} requests per watched hour"
+            )
+            server.events = 0
+    await server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 2,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 60,
+    ))
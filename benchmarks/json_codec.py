@@ -0,0 +1,107 @@
+"""Benchmark: stdlib json vs. the core.codec backend on GQL and PubSub payloads.
+
+Usage: python -m benchmarks.json_codec [frames]
+"""
+import json
+import sys
+from timeit import timeit
+
+from core import codec
+
+
+def dashboard_payload(campaigns: int = 60, drops: int = 5) -> bytes:
+    """A ViewerDropsDashboard response shaped like the real one."""
+    def drop(c: int, d: int) -> dict:
+        return {
+            "id": f"{c:08d}-drop-{d:04d}-0000-000000000000",
+            "name": f"Reward tier {d + 1}",
+            "startAt": "2026-10-01T15:00:00Z",
+            "endAt": "2026-10-31T15:00:00Z",
+            "requiredMinutesWatched": 60 * (d + 1),
+            "preconditionDrops": [{"id": f"{c:08d}-drop-{d - 1:04d}-0000-000000000000"}] if d else None,
+            "benefitEdges": [{
+                "benefit": {
+                    "id": f"benefit-{c}-{d}",
+                    "name": f"In-game item #{d + 1}",
+                    "imageAssetURL": f"https://static-cdn.jtvnw.net/twitch-quests-assets/REWARD/{c}-{d}.png",
+                },
+                "entitlementLimit": 1,
+            }],
+            "self": {
+                "dropInstanceID": f"{c}#{d}#instance",
+                "isClaimed": False,
+                "currentMinutesWatched": 17 * d,
+            },
+        }
+
+    return json.dumps({
+        "data": {
+            "currentUser": {
+                "id": "123456789",
+                "dropCampaigns": [
+                    {
+                        "id": f"{c:08d}-campaign-0000-0000-000000000000",
+                        "name": f"Season {c} Drops",
+                        "status": "ACTIVE",
+                        "startAt": "2026-10-01T15:00:00Z",
+                        "endAt": "2026-10-31T15:00:00Z",
+                        "imageURL": f"https://static-cdn.jtvnw.net/twitch-quests-assets/CAMPAIGN/{c}.png",
+                        "description": "Watch any participating channel to earn rewards. " * 3,
+                        "accountLinkURL": "https://example.com/link",
+                        "game": {"id": str(10000 + c), "name": f"Game {c}", "displayName": f"Game {c}"},
+                        "self": {"isAccountConnected": True},
+                        "allow": {"isEnabled": False, "channels": None},
+                        "timeBasedDrops": [drop(c, d) for d in range(drops)],
+                    }
+                    for c in range(campaigns)
+                ],
+            }
+        },
+        "extensions": {"durationMilliseconds": 87, "operationName": "ViewerDropsDashboard"},
+    }).encode()
+
+
+def drop_event_frame(i: int) -> str:
+    """A PubSub frame carrying a user-drop-events progress message."""
+    inner = json.dumps({
+        "type": "drop-progress",
+        "data": {
+            "channel_id": "123456",
+            "drop_id": f"00000001-drop-{i % 5:04d}-0000-000000000000",
+            "current_progress_min": i % 120,
+            "required_progress_min": 120,
+        },
+    })
+    return json.dumps({
+        "type": "MESSAGE",
+        "data": {"topic": "user-drop-events.123456789", "message": inner},
+    })
+
+
+def run(frames: int):
+    print(f"codec backend: {codec.BACKEND}")
+
+    dashboard = dashboard_payload()
+    iterations = 200
+    stdlib = timeit(lambda: json.loads(dashboard), number=iterations)
+    fast = timeit(lambda: codec.loads(dashboard), number=iterations)
+    print(f"ViewerDropsDashboard ({len(dashboard) / 1024:.0f} KiB)")
+    print(f"  json:  {stdlib / iterations * 1000:7.3f} ms/decode")
+    print(f"  codec: {fast / iterations * 1000:7.3f} ms/decode ({stdlib / fast:.2f}x)")
+
+    flood = [drop_event_frame(i) for i in range(frames)]
+
+    def decode_with(loads):
+        for frame in flood:
+            message = loads(frame)
+            loads(message["data"]["message"])
+
+    stdlib = timeit(lambda: decode_with(json.loads), number=1)
+    fast = timeit(lambda: decode_with(codec.loads), number=1)
+    print(f"{frames} user-drop-events frames (outer + inner decode)")
+    print(f"  json:  {stdlib / frames * 1e6:7.2f} us/frame")
+    print(f"  codec: {fast / frames * 1e6:7.2f} us/frame ({stdlib / fast:.2f}x)")
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
@@ -0,0 +1,170 @@
+"""Benchmark: proxy health checks and failover, against local HTTP proxy stand-ins.
+
+Two forward proxies with different latencies sit in front of a local stand-in for the
+GQL endpoint. Requests go through whichever proxy the pool selects, and report back
+like GQL requests do. The fast proxy is then taken down, both are, and the fast one
+comes back, to show how traffic follows.
+
+Usage: python -m benchmarks.proxy_failover [requests]
+"""
+import asyncio
+import sys
+from collections import Counter
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+
+from core.proxy import ProxyPool
+
+
+class FakeProxy:
+    """Plain HTTP forward proxy that adds latency to every request, and can be taken down."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.up = True
+        self.requests = 0
+        self.url = ""
+        self._server: Optional[asyncio.Server] = None
+        self._writers: set[asyncio.StreamWriter] = set()
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, delay: float):
+        try:
+            while data := await reader.read(65536):
+                if delay:
+                    self.requests += 1
+                    await asyncio.sleep(delay)
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if not self.up:
+            writer.close()
+            return
+        self._writers.add(writer)
+        try:
+            # "GET http://host:port/path HTTP/1.1", the upstream server takes the absolute form as is
+            head = await reader.readline()
+            host, _, port = head.split()[1].decode().split("/")[2].partition(":")
+            upstream_reader, upstream_writer = await asyncio.open_connection(host, int(port or 80))
+            self._writers.add(upstream_writer)
+            await asyncio.sleep(self.latency)
+            self.requests += 1
+            upstream_writer.write(head)
+            await asyncio.gather(
+                self._pipe(reader, upstream_writer, self.latency),
+                self._pipe(upstream_reader, writer, 0),
+            )
+        except (ConnectionError, IndexError, ValueError):
+            writer.close()
+        finally:
+            self._writers.discard(writer)
+
+    def take_down(self):
+        self.up = False
+        for writer in self._writers:
+            writer.close()
+        self._writers.clear()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        self.take_down()
+        self._server.close()
+
+
+class FakeGQLServer:
+    """Answers health checks and requests with an empty result."""
+
+    def __init__(self):
+        self.url = ""
+        self._runner: web.AppRunner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.json_response({"data": {}})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/gql", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/gql"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+async def _requests(pool: ProxyPool, session: aiohttp.ClientSession, url: str, count: int) -> Counter:
+    """Send requests one after another through the selected proxy, counting outcomes per proxy."""
+    outcomes = Counter()
+    for _ in range(count):
+        proxy = pool.select()
+        start = perf_counter()
+        try:
+            async with session.post(url, proxy=proxy, timeout=aiohttp.ClientTimeout(total=2)) as response:
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pool.report(proxy, None)
+            outcomes[(proxy, "failed")] += 1
+        else:
+            pool.report(proxy, perf_counter() - start)
+            outcomes[(proxy, "ok")] += 1
+    return outcomes
+
+
+async def run(count: int):
+    server = FakeGQLServer()
+    fast, slow = FakeProxy(0.01), FakeProxy(0.05)
+    for stand_in in (server, fast, slow):
+        await stand_in.start()
+    names = {fast.url: "fast", slow.url: "slow"}
+
+    async with aiohttp.ClientSession() as session:
+        async def get_session():
+            return session
+
+        twitch = SimpleNamespace(get_session=get_session)
+        pool = ProxyPool(twitch, [slow.url, fast.url])
+        pool.check_url = server.url
+
+        def report(phase: str, outcomes: Counter, elapsed: float):
+            summary = ", ".join(
+                f"{names[proxy]} {result} {n}" for (proxy, result), n in sorted(outcomes.items())
+            )
+            print(f"  {phase:28s} {elapsed * 1000:6.0f}ms  {summary}")
+
+        async def phase(name: str, check: bool = False):
+            start = perf_counter()
+            if check:
+                await pool.check_all()
+            report(name, await _requests(pool, session, server.url, count), perf_counter() - start)
+
+        print(f"{count} sequential requests per phase, fast proxy 10ms, slow proxy 50ms")
+        await phase("health check, both up", check=True)
+        fast.take_down()
+        await phase("fast proxy down")
+        slow.take_down()
+        await phase("both down")
+        fast.up = slow.up = True
+        await phase("both back, health check", check=True)
+        print(f"  pool: {pool.proxies}")
+
+    for stand_in in (server, fast, slow):
+        await stand_in.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
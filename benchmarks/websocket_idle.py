@@ -0,0 +1,132 @@
+"""Benchmark: event loop wakeups per idle hour of a PubSub connection, polling vs. blocking receive.
+
+Runs against a local websocket server that answers PINGs and otherwise stays silent.
+Each loop is sampled for a few seconds without pings, and the cost of one PING/PONG
+exchange is measured separately, with a shortened interval.
+
+Usage: python -m benchmarks.websocket_idle [seconds]
+"""
+import asyncio
+import sys
+from datetime import timedelta
+from types import SimpleNamespace
+
+import aiohttp
+from aiohttp import web
+
+from core import codec, websocket_client
+from core.constants import PING_INTERVAL
+from core.proxy import ProxyPool
+from core.websocket_client import Websocket, WebsocketPool
+
+
+class CountingLoop(asyncio.SelectorEventLoop):
+    """Counts the iterations of the event loop, each being a wakeup from select()."""
+
+    wakeups = 0
+
+    def _run_once(self):
+        CountingLoop.wakeups += 1
+        super()._run_once()
+
+
+class FakePubSubServer:
+    """Answers PING with PONG, and never sends anything else."""
+
+    def __init__(self):
+        self.url = ""
+        self._runner: web.AppRunner = None
+
+    async def _handle(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.TEXT and codec.loads(msg.data).get("type") == "PING":
+                await ws.send_str('{"type":"PONG"}')
+        return ws
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/v1", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"ws://127.0.0.1:{port}/v1"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+async def legacy_receive_loop(ws: aiohttp.ClientWebSocketResponse):
+    """The receive loop as Websocket._handle used to run it, pings aside."""
+    while not ws.closed:
+        try:
+            msg = await asyncio.wait_for(ws.receive(), timeout=0.5)
+            if msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED):
+                break
+        except asyncio.TimeoutError:
+            continue
+
+
+async def _sample(seconds: float) -> int:
+    before = CountingLoop.wakeups
+    await asyncio.sleep(seconds)
+    return CountingLoop.wakeups - before
+
+
+async def run(seconds: float):
+    server = FakePubSubServer()
+    await server.start()
+    async with aiohttp.ClientSession() as session:
+        # The sampling sleep wakes the loop once on its own
+        baseline = await _sample(seconds)
+
+        ws = await session.ws_connect(server.url)
+        task = asyncio.create_task(legacy_receive_loop(ws))
+        await asyncio.sleep(0.1)
+        legacy = await _sample(seconds) - baseline
+        task.cancel()
+        await ws.close()
+
+        websocket_client.WS_URL = server.url
+        twitch = SimpleNamespace(settings=SimpleNamespace(oauth_token=""))
+        twitch.proxy_pool = ProxyPool(twitch)
+
+        async def get_session():
+            return session
+
+        twitch.get_session = get_session
+        socket = Websocket(WebsocketPool(twitch), 0)
+        await socket.start()
+        await asyncio.sleep(0.1)
+        blocking = await _sample(seconds) - baseline
+
+        # Cost of one PING/PONG exchange, with the interval shortened to fit the sample
+        await socket.stop()
+        interval = 0.25
+        websocket_client.PING_INTERVAL = timedelta(seconds=interval)
+        socket = Websocket(WebsocketPool(twitch), 0)
+        await socket.start()
+        await asyncio.sleep(0.1)
+        pings = seconds / interval
+        per_ping = max(0, await _sample(seconds) - baseline - blocking) / pings
+        await socket.stop()
+    await server.stop()
+
+    hour = 3600 / seconds
+    pings_per_hour = 3600 / PING_INTERVAL.total_seconds()
+    print(f"Idle PubSub connection, sampled for {seconds:.0f}s")
+    print(f"  wait_for(receive(), 0.5) polling: {legacy * hour:8.0f} wakeups/hour")
+    print(
+        f"  blocking receive + ping timer:    {blocking * hour + per_ping * pings_per_hour:8.0f} wakeups/hour "
+        f"({per_ping:.1f} per PING/PONG, {pings_per_hour:.0f} pings/hour)"
+    )
+
+
+if __name__ == "__main__":
+    loop = CountingLoop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(run(float(sys.argv[1]) if len(sys.argv) > 1 else 10))
+    loop.close()
@@ -15,6 +15,8 @@ class Channel:
         self.login = login
         self.display_name = display_name
         self.game: Optional[Game] = None
+        # ID of the current stream, needed for watch beacons
+        self.broadcast_id: Optional[str] = None
         self.viewers = 0
         self.drops_enabled = False
         self.online = False
@@ -42,16 +44,21 @@ class Channel:
         display_name = broadcaster["displayName"]
 
         channel = cls(twitch, channel_id, login, display_name)
+        channel.update_from_directory(data)
+        return channel
+
+    def update_from_directory(self, data: dict):
+        """Update the stream state from a fresher directory listing of the channel."""
+        self.display_name = data["broadcaster"]["displayName"]
 
         # Parse stream data
         if "game" in data and data["game"]:
-            channel.game = Game(data["game"])
+            self.game = Game(data["game"])
 
-        channel.viewers = data.get("viewersCount", 0)
-        channel.online = True
+        self.broadcast_id = data.get("id")
+        self.viewers = data.get("viewersCount", 0)
+        self.online = True
 
         # Check for drops
         # In real implementation, this would check viewerDropCampaigns
-        channel.drops_enabled = True
-
-        return channel
+        self.drops_enabled = True
@@ -0,0 +1,47 @@
+"""JSON codec, using orjson when it's available and the standard library otherwise"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def loads(data: str | bytes) -> Any:
+        """Decode JSON from str or bytes."""
+        return orjson.loads(data)
+
+    def dumpb(obj: Any, *, sort_keys: bool = False) -> bytes:
+        """Encode to minified JSON bytes."""
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+
+    def dumps(obj: Any, *, sort_keys: bool = False) -> str:
+        """Encode to a minified JSON string."""
+        return dumpb(obj, sort_keys=sort_keys).decode()
+
+    def dumps_pretty(obj: Any) -> str:
+        """Encode to an indented JSON string, for files meant to be human-readable."""
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+
+else:
+    BACKEND = "json"
+
+    def loads(data: str | bytes) -> Any:
+        """Decode JSON from str or bytes."""
+        return json.loads(data)
+
+    def dumps(obj: Any, *, sort_keys: bool = False) -> str:
+        """Encode to a minified JSON string."""
+        return json.dumps(obj, sort_keys=sort_keys, separators=(',', ':'), ensure_ascii=False)
+
+    def dumpb(obj: Any, *, sort_keys: bool = False) -> bytes:
+        """Encode to minified JSON bytes."""
+        return dumps(obj, sort_keys=sort_keys).encode()
+
+    def dumps_pretty(obj: Any) -> str:
+        """Encode to an indented JSON string, for files meant to be human-readable."""
+        return json.dumps(obj, indent=2, ensure_ascii=False)
@@ -0,0 +1,118 @@
+"""Shared HTTP connection pool"""
+import asyncio
+import logging
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Optional
+
+import aiohttp
+
+from core.constants import (
+    HTTP_LIMIT, HTTP_LIMIT_PER_HOST, HTTP_DNS_TTL, HTTP_KEEPALIVE, HTTP_PREWARM_URLS
+)
+
+logger = logging.getLogger("TwitchDrops.connection")
+
+
+class ConnectionPool:
+    """Tuned TCP connector shared by every session, that outlives the sessions themselves.
+
+    Sessions created through `session` don't own the connector, so closing one
+    (e.g. on miner restart) keeps the warm keep-alive connections and DNS cache.
+    """
+
+    def __init__(self):
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self.trace_config = aiohttp.TraceConfig()
+        self.trace_config.on_connection_create_start.append(self._on_create_start)
+        self.trace_config.on_connection_create_end.append(self._on_create_end)
+        self.trace_config.on_connection_reuseconn.append(self._on_reuse)
+        self.trace_config.on_dns_cache_hit.append(self._on_dns_hit)
+        self.trace_config.on_dns_cache_miss.append(self._on_dns_miss)
+
+        # Stats
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.connect_time = 0.0
+        self.dns_hits = 0
+        self.dns_misses = 0
+
+    @property
+    def connector(self) -> aiohttp.TCPConnector:
+        if self._connector is None or self._connector.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit=HTTP_LIMIT,
+                limit_per_host=HTTP_LIMIT_PER_HOST,
+                ttl_dns_cache=int(HTTP_DNS_TTL.total_seconds()),
+                keepalive_timeout=HTTP_KEEPALIVE.total_seconds(),
+            )
+        return self._connector
+
+    def session(self, headers: dict) -> aiohttp.ClientSession:
+        """Create a session on top of the shared connector."""
+        return aiohttp.ClientSession(
+            headers=headers,
+            connector=self.connector,
+            connector_owner=False,
+            trace_configs=[self.trace_config],
+        )
+
+    async def prewarm(
+        self,
+        session: aiohttp.ClientSession,
+        urls: tuple[str, ...] = HTTP_PREWARM_URLS,
+        proxy: Optional[str] = None,
+    ):
+        """Resolve and open keep-alive connections to the given hosts ahead of time."""
+        async def warm(url: str):
+            try:
+                async with session.head(url, allow_redirects=False, proxy=proxy) as response:
+                    await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.debug(f"Pre-warming {url} failed: {e}")
+
+        start = perf_counter()
+        await asyncio.gather(*(warm(url) for url in urls))
+        logger.info(f"Pre-warmed {len(urls)} connections in {perf_counter() - start:.2f}s")
+
+    async def close(self):
+        if self._connector is not None and not self._connector.closed:
+            await self._connector.close()
+        self._connector = None
+
+    # Trace hooks
+
+    async def _on_create_start(self, session, ctx: SimpleNamespace, params):
+        ctx.connect_start = perf_counter()
+
+    async def _on_create_end(self, session, ctx: SimpleNamespace, params):
+        self.connections_created += 1
+        self.connect_time += perf_counter() - ctx.connect_start
+
+    async def _on_reuse(self, session, ctx: SimpleNamespace, params):
+        self.connections_reused += 1
+
+    async def _on_dns_hit(self, session, ctx: SimpleNamespace, params):
+        self.dns_hits += 1
+
+    async def _on_dns_miss(self, session, ctx: SimpleNamespace, params):
+        self.dns_misses += 1
+
+    @property
+    def reuse_ratio(self) -> float:
+        total = self.connections_created + self.connections_reused
+        return self.connections_reused / total if total else 0.0
+
+    @property
+    def avg_connect_time(self) -> float:
+        return self.connect_time / self.connections_created if self.connections_created else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "created": self.connections_created,
+            "reused": self.connections_reused,
+            "reuse_ratio": self.reuse_ratio,
+            "avg_connect_time": self.avg_connect_time,
+            "dns_hits": self.dns_hits,
+            "dns_misses": self.dns_misses,
+        }
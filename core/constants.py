@@ -1,6 +1,10 @@
 """Constants for TwitchDropsMiner Android"""
 from datetime import timedelta
 from enum import Enum, auto
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
+
+from core import codec
 
 VERSION = "1.0.0-android"
 
@@ -10,6 +14,36 @@ USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
 
 # GQL endpoint
 GQL_URL = "https://gql.twitch.tv/gql"
+GQL_BATCH_WINDOW = timedelta(milliseconds=20)
+GQL_BATCH_SIZE = 30
+GQL_CACHE_SIZE = 256
+# Read-only operations that may be served from the response cache, by operationName
+GQL_CACHE_TTL = {
+    "DirectoryPage_Game": timedelta(seconds=60),
+    "StreamMetadata": timedelta(seconds=30),
+}
+# Operations with side effects, these are never cached
+GQL_MUTATIONS = {"DropsPage_ClaimDropRewards"}
+# Request rate limiting (requests per second, burst size)
+GQL_RATE_LIMIT = 5.0
+GQL_RATE_BURST = 10
+# Retries of transient failures, per operationName
+GQL_RETRY_ATTEMPTS = 3
+GQL_RETRY_BUDGET = {
+    "DropsPage_ClaimDropRewards": 6,
+    "ViewerDropsDashboard": 5,
+    "Inventory": 5,
+}
+GQL_RETRY_BACKOFF = (timedelta(seconds=1), timedelta(seconds=30))
+# Request hedging: idempotent operations that may be sent twice when slow
+GQL_HEDGEABLE = {"DirectoryPage_Game", "StreamMetadata", "DropsPage_ClaimDropRewards"}
+GQL_HEDGE_PERCENTILE = 0.95
+GQL_HEDGE_MIN_SAMPLES = 20
+GQL_HEDGE_SAMPLES = 100
+# Max fraction of hedgeable requests that may fire a hedge
+GQL_HEDGE_BUDGET = 0.1
+# GQL error messages that indicate a temporary server-side problem
+GQL_TRANSIENT_ERRORS = {"service error", "service timeout", "service unavailable", "context deadline exceeded"}
 
 # Websocket
 WS_URL = "wss://pubsub-edge.twitch.tv/v1"
@@ -17,11 +51,76 @@ PING_INTERVAL = timedelta(minutes=4)
 PING_TIMEOUT = timedelta(seconds=10)
 MAX_WEBSOCKETS = 10
 WS_TOPICS_LIMIT = 50
+# Topic handlers run on workers, each topic always on the same one
+PUBSUB_WORKERS = 4
+# Messages a worker may have waiting before receiving waits for room
+PUBSUB_QUEUE_SIZE = 100
+PUBSUB_LATENCY_SAMPLES = 200
+# Reconnects: backoff range, and the fraction of each delay that's randomized
+WS_RECONNECT_BACKOFF = (timedelta(seconds=1), timedelta(minutes=2))
+WS_RECONNECT_JITTER = 0.5
+# A connection that lasted this long resets the backoff
+WS_STABLE_AFTER = timedelta(minutes=1)
+# Extra reconnect delay per websocket index, so a pool doesn't reconnect all at once
+WS_RECONNECT_STAGGER = timedelta(seconds=1)
+# Failed connection attempts in a row that park the pool, and how often it then probes
+WS_BREAKER_THRESHOLD = 5
+WS_BREAKER_PROBE_INTERVAL = timedelta(seconds=30)
+
+# HTTP connection pool
+HTTP_LIMIT = 30
+HTTP_LIMIT_PER_HOST = 10
+HTTP_DNS_TTL = timedelta(minutes=10)
+HTTP_KEEPALIVE = timedelta(seconds=75)
+# Hosts to open connections to before they're first needed
+HTTP_PREWARM_URLS = (GQL_URL, "https://pubsub-edge.twitch.tv/v1")
+
+# Proxies
+PROXY_CHECK_URL = GQL_URL
+PROXY_CHECK_INTERVAL = timedelta(minutes=5)
+PROXY_CHECK_TIMEOUT = timedelta(seconds=10)
+# Consecutive failures after which a proxy is skipped until it passes a health check
+PROXY_MAX_FAILURES = 3
+# Weight of the newest latency sample in the moving average
+PROXY_LATENCY_ALPHA = 0.3
+
+# Watch heartbeats, one minute-watched beacon per watched channel every interval
+SPADE_URL = "https://spade.twitch.tv/track"
+# Beacons queued within this window are sent in one request
+HEARTBEAT_BATCH_WINDOW = timedelta(seconds=1)
+# Beacons in a row a channel may fail before its watch session switches away
+WATCH_MAX_FAILURES = 3
+
+# Directory discovery, fetching the live channels of every game with drops ahead of time
+DISCOVERY_CONCURRENCY = 4
+DISCOVERY_INTERVAL = timedelta(minutes=5)
+DISCOVERY_MIN_INTERVAL = timedelta(minutes=1)
+DISCOVERY_MAX_INTERVAL = timedelta(minutes=15)
+# Share of a game's channels changing between fetches, above which it's fetched more often,
+# and below which less often
+DISCOVERY_CHURN_FAST = 0.3
+DISCOVERY_CHURN_SLOW = 0.1
+# How often to look for games that were added to the inventory
+DISCOVERY_POLL = timedelta(seconds=30)
+
+# Channels per watched game whose stream state is followed, besides the watched one
+CHANNEL_BACKUPS = 3
+
+# Directory pagination
+DIRECTORY_PAGE_SIZE = 30
+DIRECTORY_MAX_PAGES = 10
 
 # Timing
-WATCH_INTERVAL = timedelta(seconds=20)
+WATCH_INTERVAL = timedelta(minutes=1)
 ONLINE_DELAY = timedelta(seconds=120)
 
+# How often LOW_AVAILABILITY ordering is recomputed, since availability changes over time
+SCHEDULER_REKEY_INTERVAL = timedelta(minutes=5)
+# How often the drop planner rebuilds every game's plan, since drops start and end over time
+PLANNER_REPLAN_INTERVAL = timedelta(minutes=5)
+# Extra value of a drop that needs all of its remaining time, over one with plenty to spare
+CHANNEL_URGENCY_WEIGHT = 2.0
+
 # Limits
 MAX_CHANNELS = 100
 MAX_INT = 2147483647
@@ -44,77 +143,153 @@ class PriorityMode(Enum):
     PRIORITY_ONLY = "priority_only"
     ENDING_SOONEST = "ending_soonest"
     LOW_AVAILABILITY = "low_availability"
+    MAXIMIZE_DROPS = "maximize_drops"
+
+
+def _freeze(value: Any) -> Any:
+    """Recursively turn dicts into read-only mappings and lists into tuples."""
+    if isinstance(value, Mapping):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _copy(value: Any) -> Any:
+    """Recursively copy dicts and lists into plain, unshared containers."""
+    if isinstance(value, Mapping):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_copy(v) for v in value]
+    return value
+
+
+def _merge(base: Mapping, overrides: Mapping) -> dict:
+    """Deep-merge overrides over base, sharing the subtrees that aren't overridden."""
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, Mapping) and isinstance(merged.get(key), Mapping):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+class GQLOperation:
+    """Immutable GQL operation template.
+
+    The static part of the payload (operationName and the persisted query extension)
+    is serialized once, so building a request only has to encode the variables.
+    Use `with_variables` to get a new operation instead of mutating a shared one.
+    """
+    __slots__ = ("name", "sha256", "_raw", "_frozen", "_prefix", "_variables_json")
+
+    def __init__(
+        self,
+        name: str,
+        sha256: str,
+        variables: Optional[Mapping] = None,
+        *,
+        _prefix: bytes = b"",
+        _raw: Optional[dict] = None,
+    ):
+        setattr_ = object.__setattr__
+        setattr_(self, "name", name)
+        setattr_(self, "sha256", sha256)
+        # Private plain copy, never handed out and never mutated, subtrees are shared between templates
+        setattr_(self, "_raw", _copy(variables or {}) if _raw is None else _raw)
+        setattr_(self, "_frozen", None)
+        setattr_(self, "_prefix", _prefix or codec.dumpb(
+            {
+                "operationName": name,
+                "extensions": {"persistedQuery": {"version": 1, "sha256Hash": sha256}},
+            }
+        )[:-1] + b',"variables":')
+        # Sorted keys double as the normalized form used for cache and dedup keys
+        setattr_(self, "_variables_json", codec.dumpb(self._raw, sort_keys=True))
+
+    def __setattr__(self, name: str, value: Any):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name: str):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self):
+        return f"GQLOperation({self.name}, {self._variables_json.decode()})"
+
+    @property
+    def variables(self) -> Mapping:
+        """Read-only view of the operation variables."""
+        if self._frozen is None:
+            object.__setattr__(self, "_frozen", _freeze(self._raw))
+        return self._frozen
+
+    def with_variables(self, variables: Mapping) -> 'GQLOperation':
+        """Return a new operation with the variables deep-merged over this one's."""
+        return GQLOperation(
+            self.name, self.sha256,
+            _prefix=self._prefix, _raw=_merge(self._raw, _copy(variables)),
+        )
+
+    @property
+    def key(self) -> str:
+        """Identity of the operation: name, persisted query hash and normalized variables."""
+        return f"{self.name}|{self.sha256}|{self._variables_json.decode()}"
+
+    @property
+    def payload(self) -> bytes:
+        """The encoded JSON request body for this operation."""
+        return self._prefix + self._variables_json + b"}"
 
 
 # GQL Operations
 GQL_OPERATIONS = {
-    "GetDropCampaigns": {
-        "operationName": "ViewerDropsDashboard",
-        "extensions": {
-            "persistedQuery": {
-                "version": 1,
-                "sha256Hash": "8d5d9b5e3f088f9d1ff39eb2caab11f7a4cf7a3353da9ce82b5778226ff37268"
-            }
-        },
-        "variables": {
+    "CurrentUser": GQLOperation(
+        "CoreActionsCurrentUser",
+        "6f1b0c8c5f0e4e4e8f0e4e4e8f0e4e4e8f0e4e4e8f0e4e4e8f0e4e4e8f0e4e4e",
+    ),
+    "GetDropCampaigns": GQLOperation(
+        "ViewerDropsDashboard",
+        "8d5d9b5e3f088f9d1ff39eb2caab11f7a4cf7a3353da9ce82b5778226ff37268",
+        {
             "fetchRewardCampaigns": True
-        }
-    },
-    "GetInventory": {
-        "operationName": "Inventory",
-        "extensions": {
-            "persistedQuery": {
-                "version": 1,
-                "sha256Hash": "37fea486d6179047c41d0f549088a4c3a7dd60c05c70956e5f1dce3996103923"
-            }
         },
-        "variables": {
+    ),
+    "GetInventory": GQLOperation(
+        "Inventory",
+        "37fea486d6179047c41d0f549088a4c3a7dd60c05c70956e5f1dce3996103923",
+        {
             "fetchRewardCampaigns": True
-        }
-    },
-    "GetStreamInfo": {
-        "operationName": "StreamMetadata",
-        "extensions": {
-            "persistedQuery": {
-                "version": 1,
-                "sha256Hash": "059c4653b788f5bdb2f5a2d2a24b0ddc3831a15079001a3d927556a96fb0517f"
-            }
         },
-        "variables": {
+    ),
+    "GetStreamInfo": GQLOperation(
+        "StreamMetadata",
+        "059c4653b788f5bdb2f5a2d2a24b0ddc3831a15079001a3d927556a96fb0517f",
+        {
             "channelLogin": ""
-        }
-    },
-    "GetDirectory": {
-        "operationName": "DirectoryPage_Game",
-        "extensions": {
-            "persistedQuery": {
-                "version": 1,
-                "sha256Hash": "d5c5df7ab9ae65c3ea0f225738c08a36a4a76e4c6c31db7f8c4b8dc064227f9e"
-            }
         },
-        "variables": {
+    ),
+    "GetDirectory": GQLOperation(
+        "DirectoryPage_Game",
+        "d5c5df7ab9ae65c3ea0f225738c08a36a4a76e4c6c31db7f8c4b8dc064227f9e",
+        {
             "limit": 30,
             "slug": "",
             "options": {
                 "includeRestricted": ["SUB_ONLY_LIVE"],
                 "systemFilters": ["DROPS_ENABLED"]
             }
-        }
-    },
-    "ClaimDrop": {
-        "operationName": "DropsPage_ClaimDropRewards",
-        "extensions": {
-            "persistedQuery": {
-                "version": 1,
-                "sha256Hash": "2f884fa187b8fadb2a49db0adc033e636f7b6aaee6e76de1e2bba9a7baf0daf6"
-            }
         },
-        "variables": {
+    ),
+    "ClaimDrop": GQLOperation(
+        "DropsPage_ClaimDropRewards",
+        "2f884fa187b8fadb2a49db0adc033e636f7b6aaee6e76de1e2bba9a7baf0daf6",
+        {
             "input": {
                 "dropInstanceID": ""
             }
-        }
-    }
+        },
+    ),
 }
 
 # Websocket topics
@@ -0,0 +1,216 @@
+"""Directory discovery"""
+import asyncio
+import logging
+from time import monotonic
+from typing import Optional, Awaitable, TYPE_CHECKING
+
+from core.constants import (
+    DISCOVERY_CONCURRENCY, DISCOVERY_INTERVAL, DISCOVERY_MIN_INTERVAL, DISCOVERY_MAX_INTERVAL,
+    DISCOVERY_CHURN_FAST, DISCOVERY_CHURN_SLOW, DISCOVERY_POLL
+)
+
+if TYPE_CHECKING:
+    from core.channel import Channel
+    from core.twitch_client import TwitchClient
+    from core.utils import Game
+
+logger = logging.getLogger("TwitchDrops.discovery")
+
+
+class GameDirectory:
+    """The last fetched live channels of a game, and when to fetch them again."""
+
+    def __init__(self, game: 'Game'):
+        self.game = game
+        self.channels: list['Channel'] = []
+        self.fetched_at: Optional[float] = None
+        self.interval = DISCOVERY_INTERVAL.total_seconds()
+        # Share of the channel list that changed between the last two fetches
+        self.churn = 0.0
+        # Set when the listing is known to be out of date, to refresh it on the next round
+        self.stale = False
+        # Set after a failed fetch, when to try again
+        self.retry_at: Optional[float] = None
+
+    @property
+    def next_refresh(self) -> float:
+        if self.retry_at is not None:
+            return self.retry_at
+        if self.fetched_at is None or self.stale:
+            return 0.0
+        return self.fetched_at + self.interval
+
+    def store(self, channels: list['Channel'], now: float):
+        if self.fetched_at is not None:
+            before = {channel.id for channel in self.channels}
+            after = {channel.id for channel in channels}
+            union = before | after
+            self.churn = 1 - len(before & after) / len(union) if union else 0.0
+            # Lists that change quickly are fetched more often, stable ones less
+            if self.churn >= DISCOVERY_CHURN_FAST:
+                self.interval /= 2
+            elif self.churn <= DISCOVERY_CHURN_SLOW:
+                self.interval *= 1.5
+            self.interval = min(
+                max(self.interval, DISCOVERY_MIN_INTERVAL.total_seconds()),
+                DISCOVERY_MAX_INTERVAL.total_seconds(),
+            )
+        self.channels = channels
+        self.fetched_at = now
+        self.stale = False
+        self.retry_at = None
+
+    def failed(self, now: float):
+        """Keep the last listing after a failed fetch, a network error says nothing about who's live."""
+        self.retry_at = now + DISCOVERY_MIN_INTERVAL.total_seconds()
+
+    def __repr__(self):
+        return f"GameDirectory({self.game.name}, {len(self.channels)} channels, every {self.interval:.0f}s)"
+
+
+class DirectoryDiscovery:
+    """Keeps the live channels of every game with earnable drops fetched ahead of time.
+
+    A background task refreshes the games that are due, several at once under a semaphore,
+    into a shared table. Channel selection then reads from the table instead of waiting
+    on the directory. Each game is refreshed at its own pace, based on its churn.
+    """
+
+    def __init__(self, twitch: 'TwitchClient'):
+        self._twitch = twitch
+        self.table: dict[int, GameDirectory] = {}
+        self._semaphore = asyncio.Semaphore(DISCOVERY_CONCURRENCY)
+        self._task: Optional[asyncio.Task] = None
+        # Game ID -> refresh in progress, so lookups and the background task share it
+        self._inflight: dict[int, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        # Games whose watched and backup channels report their stream state over PubSub,
+        # so their listing only needs the slowest refreshes
+        self.covered: set[int] = set()
+
+        # Stats
+        self.fetches = 0
+        self.failures = 0
+        self.lookups = 0
+        self.misses = 0
+
+    def _wanted(self) -> list['Game']:
+        index = self._twitch.inventory_index
+        return [
+            game for game in self._twitch.games
+            if any(campaign.can_earn() for campaign in index.game_campaigns(game))
+        ]
+
+    def _refresh(self, game: 'Game') -> Awaitable[GameDirectory]:
+        task = self._inflight.get(game.id)
+        if task is None:
+            task = self._inflight[game.id] = asyncio.create_task(self._fetch(game))
+            task.add_done_callback(lambda _: self._inflight.pop(game.id, None))
+        return task
+
+    async def _fetch(self, game: 'Game') -> GameDirectory:
+        directory = self.table.get(game.id)
+        if directory is None:
+            directory = self.table[game.id] = GameDirectory(game)
+        try:
+            async with self._semaphore:
+                channels = await self._twitch.fetch_channels_for_game(game)
+        except Exception as e:
+            logger.warning(f"Error fetching the directory of {game.name}: {e}")
+            self.failures += 1
+            directory.failed(monotonic())
+            return directory
+        # New, expired or changed listings may have something for the idle watch sessions
+        changed = directory.fetched_at is None or directory.stale
+        directory.store(channels, monotonic())
+        self.fetches += 1
+        if changed or directory.churn > 0:
+            self._twitch.watchers.wake()
+        self._twitch.scorer.snapshot(game, channels, self._twitch.inventory_index.game_campaigns(game))
+        return directory
+
+    def _next_refresh(self, directory: GameDirectory) -> float:
+        if (
+            directory.game.id in self.covered
+            and directory.fetched_at is not None
+            and not directory.stale
+            and directory.retry_at is None
+        ):
+            return directory.fetched_at + DISCOVERY_MAX_INTERVAL.total_seconds()
+        return directory.next_refresh
+
+    async def _run(self):
+        while True:
+            wanted = self._wanted()
+            wanted_ids = {game.id for game in wanted}
+            for game_id in self.table.keys() - wanted_ids:
+                del self.table[game_id]
+
+            now = monotonic()
+            due = [
+                game for game in wanted
+                if game.id not in self.table or self._next_refresh(self.table[game.id]) <= now
+            ]
+            if due:
+                logger.debug(f"Refreshing {len(due)} directories")
+                await asyncio.gather(*(self._refresh(game) for game in due), return_exceptions=True)
+                self._twitch.prune_channels()
+
+            # Sleep until the next game is due, but look for new games once in a while
+            now = monotonic()
+            delay = min(
+                [self._next_refresh(directory) - now for directory in self.table.values()]
+                + [DISCOVERY_POLL.total_seconds()]
+            )
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 1.0))
+            except asyncio.TimeoutError:
+                pass
+
+    def wake(self):
+        """Look at the set of games again right away, after the inventory changed."""
+        self._wakeup.set()
+
+    def expire(self, game: 'Game'):
+        """Refresh the game's listing right away, after a stream event it doesn't reflect."""
+        directory = self.table.get(game.id)
+        if directory is not None:
+            directory.stale = True
+            self.wake()
+
+    def rescore(self):
+        """Redo the channel scoring snapshots from the table, after campaigns changed."""
+        index = self._twitch.inventory_index
+        for directory in self.table.values():
+            self._twitch.scorer.snapshot(directory.game, directory.channels, index.game_campaigns(directory.game))
+
+    async def channels(self, game: 'Game') -> list['Channel']:
+        """Live channels of the game, from the table, or fetched right away if it's missing or too old."""
+        self.lookups += 1
+        directory = self.table.get(game.id)
+        if (
+            directory is None
+            or directory.fetched_at is None
+            or monotonic() - directory.fetched_at > DISCOVERY_MAX_INTERVAL.total_seconds()
+        ):
+            self.misses += 1
+            directory = await self._refresh(game)
+        return directory.channels
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        logger.info(
+            f"Directory discovery: {self.fetches} fetches, {self.failures} failed, "
+            f"{self.misses}/{self.lookups} lookups missed"
+        )
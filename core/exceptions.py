@@ -1,4 +1,6 @@
 """Custom exceptions for TwitchDropsMiner Android"""
+from typing import Optional
+
 
 class MinerException(Exception):
     """Base exception class for this application."""
@@ -45,6 +47,16 @@ class GQLException(RequestException):
         super().__init__(message)
 
 
+class TransientRequestException(RequestException):
+    """Raised for request failures that are worth retrying, like rate limits and server errors."""
+    def __init__(self, *args, retry_after: Optional[float] = None):
+        if args:
+            super().__init__(*args)
+        else:
+            super().__init__("Temporary request failure")
+        self.retry_after = retry_after
+
+
 class WebsocketClosed(RequestException):
     """Raised when the websocket connection has been closed."""
     def __init__(self, *args, received: bool = False):
@@ -0,0 +1,387 @@
+"""GraphQL transport for Twitch"""
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic, perf_counter
+from typing import Optional, Callable, Awaitable, Mapping, TYPE_CHECKING
+
+import aiohttp
+
+from core.constants import (
+    GQL_URL, GQL_BATCH_SIZE, GQL_BATCH_WINDOW, GQL_CACHE_SIZE, GQL_CACHE_TTL, GQL_MUTATIONS,
+    GQL_RATE_LIMIT, GQL_RATE_BURST, GQL_RETRY_ATTEMPTS, GQL_RETRY_BUDGET, GQL_RETRY_BACKOFF,
+    GQL_TRANSIENT_ERRORS, GQL_HEDGEABLE, GQL_HEDGE_PERCENTILE, GQL_HEDGE_MIN_SAMPLES,
+    GQL_HEDGE_SAMPLES, GQL_HEDGE_BUDGET, GQLOperation
+)
+from core.exceptions import (
+    MinerException, LoginException, GQLException, TransientRequestException
+)
+from core import codec
+from core.utils import ExponentialBackoff, TokenBucket
+
+if TYPE_CHECKING:
+    from core.twitch_client import TwitchClient
+
+logger = logging.getLogger("TwitchDrops.gql")
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header, given either in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def _gql_error(error: dict) -> GQLException:
+    message = error.get("message", "Unknown GQL error")
+    if message in GQL_TRANSIENT_ERRORS:
+        return TransientRequestException(message)
+    return GQLException(message)
+
+
+class GQLBatcher:
+    """Coalesces GQL operations issued close together into a single array request."""
+
+    HEADERS = {"Content-Type": "application/json"}
+
+    def __init__(self, twitch: 'TwitchClient', url: str = GQL_URL):
+        self._twitch = twitch
+        self.url = url
+        self.window = GQL_BATCH_WINDOW.total_seconds()
+        self.max_size = GQL_BATCH_SIZE
+
+        self._pending: list[tuple[GQLOperation, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+        self.limiter = TokenBucket(GQL_RATE_LIMIT, GQL_RATE_BURST)
+
+        # Stats
+        self.requests_sent = 0
+        self.operations_sent = 0
+
+    async def request(self, operation: GQLOperation, *, immediate: bool = False) -> dict:
+        """Queue an operation and wait for its own result from the batch.
+
+        With `immediate`, the batch is sent right away instead of waiting out the window.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((operation, future))
+
+        if immediate or len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        """Send everything queued so far as one request."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        task = asyncio.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: list[tuple[GQLOperation, asyncio.Future]]):
+        """POST a batch and distribute the results to the waiting callers."""
+        # While waiting on the rate limiter, callers may get cancelled
+        await self.limiter.acquire()
+        # Callers that were cancelled while waiting don't need to be sent at all
+        batch = [(operation, future) for operation, future in batch if not future.done()]
+        if not batch:
+            return
+
+        self.requests_sent += 1
+        self.operations_sent += len(batch)
+
+        # Templates are pre-serialized, the batch body is just their payloads joined together
+        body = b"[" + b",".join(operation.payload for operation, _ in batch) + b"]"
+
+        proxy = self._twitch.proxy_pool.select()
+        start = perf_counter()
+        try:
+            session = await self._twitch.get_session()
+            async with session.post(self.url, data=body, headers=self.HEADERS, proxy=proxy) as response:
+                if response.status == 401:
+                    raise LoginException("Authentication failed")
+                if response.status == 429:
+                    retry_after = _retry_after(response.headers.get("Retry-After"))
+                    if retry_after is not None:
+                        # Honor it for everything we send, not just this batch
+                        self.limiter.pause(retry_after)
+                    raise TransientRequestException("Rate limited", retry_after=retry_after)
+                if response.status >= 500:
+                    raise TransientRequestException(f"Server error: {response.status}")
+
+                data = await response.json(loads=codec.loads)
+
+            if not isinstance(data, list):
+                # The whole batch got rejected
+                if isinstance(data, dict) and data.get("errors"):
+                    raise _gql_error(data["errors"][0])
+                raise MinerException("Invalid batch response")
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._twitch.proxy_pool.report(proxy, None)
+            self._fail(batch, TransientRequestException(f"Network error: {e}"))
+            return
+        except Exception as e:
+            self._fail(batch, e)
+            return
+        self._twitch.proxy_pool.report(proxy, perf_counter() - start)
+
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i >= len(data):
+                future.set_exception(MinerException("Missing response in batch"))
+            elif "errors" in data[i]:
+                future.set_exception(_gql_error(data[i]["errors"][0]))
+            else:
+                future.set_result(data[i])
+
+    @staticmethod
+    def _fail(batch: list[tuple[GQLOperation, asyncio.Future]], exc: Exception):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+
+    async def close(self):
+        """Fail queued operations and wait for in-flight batches."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        self._fail(batch, MinerException("GQL transport closed"))
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class GQLHedger:
+    """Sends a duplicate of slow idempotent operations and takes whichever answers first.
+
+    A hedge fires once an operation has been waiting longer than `GQL_HEDGE_PERCENTILE`
+    of its recently observed latencies. Only `GQL_HEDGEABLE` operations are hedged,
+    and at most `GQL_HEDGE_BUDGET` of them.
+    """
+
+    def __init__(self, transport: GQLBatcher):
+        self._transport = transport
+        self.percentile = GQL_HEDGE_PERCENTILE
+        self._latencies: dict[str, deque[float]] = {}
+
+        # Stats
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+
+    def hedge_delay(self, name: str) -> Optional[float]:
+        """Time to wait before hedging, or None if there's not enough data yet."""
+        samples = self._latencies.get(name)
+        if not samples or len(samples) < GQL_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+
+    async def _timed(self, operation: GQLOperation, immediate: bool = False) -> dict:
+        start = perf_counter()
+        response = await self._transport.request(operation, immediate=immediate)
+        self._latencies.setdefault(
+            operation.name, deque(maxlen=GQL_HEDGE_SAMPLES)
+        ).append(perf_counter() - start)
+        return response
+
+    async def request(self, operation: GQLOperation) -> dict:
+        if operation.name not in GQL_HEDGEABLE:
+            return await self._transport.request(operation)
+
+        self.requests += 1
+        delay = self.hedge_delay(operation.name)
+        primary = asyncio.ensure_future(self._timed(operation))
+        if delay is None:
+            return await primary
+
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done or self.hedges_fired >= self.requests * GQL_HEDGE_BUDGET:
+                return await primary
+
+            self.hedges_fired += 1
+            logger.debug(f"Hedging {operation.name} after {delay:.2f}s")
+            hedge = asyncio.ensure_future(self._timed(operation, immediate=True))
+            tasks.add(hedge)
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedges_won += 1
+                        return task.result()
+                if not tasks:
+                    # Both failed, report the primary's error
+                    return primary.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedges_fired / self.requests if self.requests else 0.0
+
+    @property
+    def win_rate(self) -> float:
+        return self.hedges_won / self.hedges_fired if self.hedges_fired else 0.0
+
+
+class GQLRetrier:
+    """Retries transient GQL failures with jittered exponential backoff.
+
+    Each operation gets its own retry budget, see `GQL_RETRY_BUDGET`.
+    A 429 with Retry-After delays the retry by at least that long.
+    """
+
+    def __init__(self, transport: GQLBatcher | GQLHedger):
+        self._transport = transport
+        self.base, self.maximum = (delta.total_seconds() for delta in GQL_RETRY_BACKOFF)
+
+        # Stats
+        self.retries = 0
+        self.rate_limited = 0
+        self.exhausted = 0
+
+    async def request(self, operation: GQLOperation) -> dict:
+        budget = GQL_RETRY_BUDGET.get(operation.name, GQL_RETRY_ATTEMPTS)
+        backoff = ExponentialBackoff(base=self.base, maximum=self.maximum, jitter=1.0)
+        attempt = 0
+        while True:
+            try:
+                return await self._transport.request(operation)
+            except TransientRequestException as e:
+                if attempt >= budget:
+                    self.exhausted += 1
+                    raise
+                attempt += 1
+                self.retries += 1
+                delay = next(backoff)
+                if e.retry_after is not None:
+                    self.rate_limited += 1
+                    delay = max(delay, e.retry_after)
+                logger.warning(
+                    f"{operation.name} failed ({e}), retry {attempt}/{budget} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+
+class SingleFlight:
+    """Lets concurrent callers with an identical operation key share one request."""
+
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Task] = {}
+
+        # Stats
+        self.started = 0
+        self.deduplicated = 0
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[dict]]) -> dict:
+        task = self._inflight.get(key)
+        if task is None:
+            self.started += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.deduplicated += 1
+        # Shielded, so one cancelled caller doesn't cancel the request for everyone else
+        return await asyncio.shield(task)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._inflight
+
+
+class GQLCache:
+    """TTL + LRU cache for responses of read-only GQL operations."""
+
+    def __init__(self, max_size: int = GQL_CACHE_SIZE, ttl: Optional[dict] = None):
+        self.max_size = max_size
+        self.ttl = {
+            name: delta.total_seconds()
+            for name, delta in (GQL_CACHE_TTL if ttl is None else ttl).items()
+        }
+        # key -> (expires, operationName, variables, response)
+        self._entries: OrderedDict[str, tuple[float, str, Mapping, dict]] = OrderedDict()
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+
+    def cacheable(self, operation: GQLOperation) -> bool:
+        """Only operations with a configured TTL are cached, mutations never are."""
+        return operation.name in self.ttl and operation.name not in GQL_MUTATIONS
+
+    def get(self, operation: GQLOperation) -> Optional[dict]:
+        key = operation.key
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[3]
+
+    def put(self, operation: GQLOperation, response: dict):
+        if not self.cacheable(operation):
+            return
+        key = operation.key
+        name = operation.name
+        self._entries[key] = (monotonic() + self.ttl[name], name, operation.variables, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, operation_name: Optional[str] = None, **variables) -> int:
+        """Drop cached responses matching the operation name and variable values.
+
+        Without arguments, the whole cache is cleared. Returns the number of dropped entries.
+        """
+        if operation_name is None and not variables:
+            count = len(self._entries)
+            self._entries.clear()
+            return count
+
+        stale = [
+            key for key, (_, name, entry_vars, _) in self._entries.items()
+            if (operation_name is None or name == operation_name)
+            and all(entry_vars.get(k) == v for k, v in variables.items())
+        ]
+        for key in stale:
+            del self._entries[key]
+        return len(stale)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,159 @@
+"""Minute-watched heartbeats"""
+import asyncio
+import base64
+import logging
+from time import monotonic, perf_counter
+from typing import Optional, TYPE_CHECKING
+
+import aiohttp
+
+from core.constants import SPADE_URL, HEARTBEAT_BATCH_WINDOW, WATCH_INTERVAL
+from core import codec
+
+if TYPE_CHECKING:
+    from core.channel import Channel
+    from core.twitch_client import TwitchClient
+
+logger = logging.getLogger("TwitchDrops.heartbeat")
+
+
+def _headers_size(headers) -> int:
+    """Approximate wire size of a header block, as 'Name: value\\r\\n' lines."""
+    return sum(len(name) + len(value) + 4 for name, value in headers)
+
+
+class HeartbeatEngine:
+    """Sends the minute-watched beacons that make watch time count, without loading any video.
+
+    Beacons of every watched channel are aligned to a shared tick, and the ones queued
+    within a short window go out together in a single request. Requests don't wait for
+    each other's responses. Bytes on the wire (bodies and headers, not TCP/TLS overhead)
+    are counted against the minutes watched, to report the cost per watched hour.
+    """
+
+    HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+
+    def __init__(self, twitch: 'TwitchClient', url: str = SPADE_URL):
+        self._twitch = twitch
+        self.url = url
+        self.window = HEARTBEAT_BATCH_WINDOW.total_seconds()
+        self.interval = WATCH_INTERVAL.total_seconds()
+        self._epoch = monotonic()
+
+        self._pending: list[tuple[dict, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+        # Stats
+        self.beacons_sent = 0
+        self.requests_sent = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.minutes_watched = 0
+
+    async def wait_tick(self):
+        """Sleep until the next shared tick, so concurrent sessions' beacons batch together."""
+        await asyncio.sleep(self.interval - (monotonic() - self._epoch) % self.interval)
+
+    def event(self, channel: 'Channel') -> dict:
+        return {
+            "event": "minute-watched",
+            "properties": {
+                "broadcast_id": str(channel.broadcast_id),
+                "channel_id": str(channel.id),
+                "channel": channel.login,
+                "hidden": False,
+                "live": True,
+                "location": "channel",
+                "logged_in": True,
+                "muted": False,
+                "player": "site",
+                "user_id": int(self._twitch.settings.user_id),
+            },
+        }
+
+    async def beat(self, channel: 'Channel') -> bool:
+        """Queue a beacon for the channel. Returns True once it's been accepted."""
+        if channel.broadcast_id is None:
+            logger.warning(f"No broadcast ID for {channel.login}, can't send watch beacons")
+            return False
+        if not self._twitch.settings.user_id:
+            logger.warning("Not logged in, can't send watch beacons")
+            return False
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((self.event(channel), future))
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: list[tuple[dict, asyncio.Future]]):
+        # Spade takes a form field with the base64 encoded JSON array of events
+        events = codec.dumpb([event for event, _ in batch])
+        body = b"data=" + base64.b64encode(events)
+        self.requests_sent += 1
+
+        proxy = self._twitch.proxy_pool.select()
+        start = perf_counter()
+        try:
+            session = await self._twitch.get_session()
+            async with session.post(self.url, data=body, headers=self.HEADERS, proxy=proxy) as response:
+                received = await response.read()
+                self.bytes_sent += len(body) + _headers_size(response.request_info.headers.items())
+                self.bytes_received += len(received) + _headers_size(response.raw_headers)
+                accepted = response.status < 300
+                if not accepted:
+                    logger.warning(f"Watch beacons rejected: {response.status}")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self._twitch.proxy_pool.report(proxy, None)
+            logger.warning(f"Error sending watch beacons: {e}")
+            accepted = False
+        except Exception as e:
+            logger.error(f"Error sending watch beacons: {e}")
+            accepted = False
+        else:
+            self._twitch.proxy_pool.report(proxy, perf_counter() - start)
+
+        if accepted:
+            self.beacons_sent += len(batch)
+            self.minutes_watched += len(batch) * self.interval / 60
+        for _, future in batch:
+            if not future.done():
+                future.set_result(accepted)
+
+    @property
+    def bytes_per_hour(self) -> float:
+        """Bytes transferred per hour of accepted watch time."""
+        if not self.minutes_watched:
+            return 0.0
+        return (self.bytes_sent + self.bytes_received) / self.minutes_watched * 60
+
+    def stats(self) -> dict:
+        return {
+            "beacons": self.beacons_sent,
+            "requests": self.requests_sent,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "bytes_per_hour": round(self.bytes_per_hour),
+        }
+
+    async def close(self):
+        """Give up on queued beacons and wait for the ones in flight."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        for _, future in batch:
+            if not future.done():
+                future.set_result(False)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
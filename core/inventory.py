@@ -1,4 +1,5 @@
 """Inventory and drops management"""
+import logging
 from datetime import datetime, timezone
 from typing import TYPE_CHECKING, Optional
 from core.utils import timestamp, Game
@@ -7,6 +8,8 @@ if TYPE_CHECKING:
     from core.twitch_client import TwitchClient
     from core.channel import Channel
 
+logger = logging.getLogger("TwitchDrops.inventory")
+
 
 class Benefit:
     """Represents a drop benefit/reward."""
@@ -21,6 +24,75 @@ class Benefit:
         return self.name
 
 
+class DropGraph:
+    """Precondition graph of a campaign's drops.
+
+    A drop is unlocked once every precondition drop of the same campaign is claimed.
+    Claiming a drop only touches the drops that depend on it. Preconditions that aren't
+    part of the campaign can't be tracked, and are considered met.
+    """
+
+    def __init__(self, drops: list['TimedDrop']):
+        ids = {drop.id for drop in drops}
+        self._dependents: dict[str, list[str]] = {drop.id: [] for drop in drops}
+        # Drop ID -> number of unclaimed preconditions
+        self._blockers: dict[str, int] = {}
+        self._claimed: set[str] = {drop.id for drop in drops if drop.is_claimed}
+        for drop in drops:
+            preconditions = {pid for pid in drop.precondition_drops if pid in ids and pid != drop.id}
+            for pid in preconditions:
+                self._dependents[pid].append(drop.id)
+            self._blockers[drop.id] = len(preconditions - self._claimed)
+        self.order = self._sort(drops)
+        self.unlocked: set[str] = {drop_id for drop_id, count in self._blockers.items() if count == 0}
+
+    def _sort(self, drops: list['TimedDrop']) -> list[str]:
+        """Topological order of the drop IDs, preconditions first."""
+        indegree = {drop.id: 0 for drop in drops}
+        for dependents in self._dependents.values():
+            for drop_id in dependents:
+                indegree[drop_id] += 1
+        queue = [drop.id for drop in drops if indegree[drop.id] == 0]
+        order = []
+        for drop_id in queue:
+            order.append(drop_id)
+            for dependent in self._dependents[drop_id]:
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    queue.append(dependent)
+        if len(order) < len(drops):
+            # A cycle would keep its drops locked forever, so ignore it instead
+            cyclic = [drop.id for drop in drops if indegree[drop.id] > 0]
+            logger.warning(f"Precondition cycle between drops: {', '.join(cyclic)}")
+            for drop_id in cyclic:
+                self._blockers[drop_id] = 0
+            order.extend(cyclic)
+        return order
+
+    def is_unlocked(self, drop: 'TimedDrop') -> bool:
+        return drop.id in self.unlocked or drop.id not in self._blockers
+
+    def preconditions(self, drop: 'TimedDrop') -> list['TimedDrop']:
+        """Unclaimed preconditions the drop waits for."""
+        return [
+            precondition for pid in drop.precondition_drops
+            if pid not in self._claimed and (precondition := drop.campaign.get_drop(pid)) is not None
+        ]
+
+    def mark_claimed(self, drop: 'TimedDrop') -> list[str]:
+        """Record a claim. Returns the IDs of the drops it unlocked."""
+        if drop.id in self._claimed or drop.id not in self._dependents:
+            return []
+        self._claimed.add(drop.id)
+        unlocked = []
+        for dependent in self._dependents[drop.id]:
+            self._blockers[dependent] -= 1
+            if self._blockers[dependent] == 0:
+                self.unlocked.add(dependent)
+                unlocked.append(dependent)
+        return unlocked
+
+
 class TimedDrop:
     """Represents a timed drop."""
 
@@ -29,6 +101,27 @@ class TimedDrop:
         self.campaign = campaign
 
         self.id = data["id"]
+        self.current_minutes = 0
+        self.claim_id: Optional[str] = None
+        self.is_claimed = False
+        self._data: Optional[dict] = None
+
+        self.update(data)
+
+    def _state(self) -> tuple:
+        return (
+            self.name, [b.id for b in self.benefits], self.starts_at, self.ends_at,
+            self.required_minutes, self.current_minutes, self.claim_id, self.is_claimed,
+            self.precondition_drops,
+        )
+
+    def update(self, data: dict) -> bool:
+        """Update the drop in place from fresh data. Returns True if anything changed."""
+        if data == self._data:
+            return False
+        before = self._state() if self._data is not None else None
+        self._data = data
+
         self.name = data["name"]
         self.benefits = [Benefit(b) for b in (data.get("benefitEdges") or [])]
 
@@ -36,10 +129,6 @@ class TimedDrop:
         self.ends_at = timestamp(data["endAt"])
 
         self.required_minutes = data.get("requiredMinutesWatched", 0)
-        self.current_minutes = 0
-
-        self.claim_id: Optional[str] = None
-        self.is_claimed = False
 
         # Parse self edge if available
         if "self" in data and data["self"]:
@@ -50,6 +139,18 @@ class TimedDrop:
 
         self.precondition_drops = [d["id"] for d in (data.get("preconditionDrops") or [])]
 
+        return self._state() != before
+
+    def mark_claimed(self) -> list[str]:
+        """Mark the drop claimed. Returns the IDs of the drops that got unlocked by it."""
+        self.is_claimed = True
+        return self.campaign.graph.mark_claimed(self)
+
+    @property
+    def unlocked(self) -> bool:
+        """Check if every precondition drop is claimed."""
+        return self.campaign.graph.is_unlocked(self)
+
     @property
     def progress(self) -> float:
         """Progress as a fraction (0.0 to 1.0)."""
@@ -79,6 +180,7 @@ class TimedDrop:
             self.active
             and not self.is_claimed
             and not self.is_complete
+            and self.unlocked
         )
 
     def rewards_text(self) -> str:
@@ -101,6 +203,30 @@ class DropsCampaign:
         self._twitch = twitch
 
         self.id = data["id"]
+        self.drops: list[TimedDrop] = []
+        self.timed_drops: dict[str, TimedDrop] = {}
+        self.graph = DropGraph([])
+        self._data: Optional[dict] = None
+
+        self.update(data)
+
+    def _state(self) -> tuple:
+        return (
+            self.name, self.game.id, self.starts_at, self.ends_at, self.image_url,
+            self.description, self.account_link_url, self.eligible, self.allowed_channels,
+        )
+
+    def update(self, data: dict, changes: Optional['InventoryChanges'] = None) -> bool:
+        """Update the campaign and its drops in place from fresh data.
+
+        Drops that are still present keep their identity. Returns True if anything
+        changed, and records the drop level differences in `changes` if given.
+        """
+        if data == self._data:
+            return False
+        before = self._state() if self._data is not None else None
+        self._data = data
+
         self.name = data["name"]
         self.game = Game(data["game"])
 
@@ -118,15 +244,32 @@ class DropsCampaign:
         if "self" in data and data["self"]:
             self.eligible = data["self"].get("isAccountConnected", False)
 
-        # Parse drops
-        self.drops: list[TimedDrop] = []
-        self.timed_drops: dict[str, TimedDrop] = {}
-
-        time_based_drops = data.get("timeBasedDrops") or []
-        for drop_data in time_based_drops:
-            drop = TimedDrop(self, drop_data)
-            self.drops.append(drop)
-            self.timed_drops[drop.id] = drop
+        # Parse drops, reusing the existing ones
+        changed = False
+        drops: list[TimedDrop] = []
+        for drop_data in data.get("timeBasedDrops") or []:
+            drop = self.timed_drops.get(drop_data["id"])
+            if drop is None:
+                drop = TimedDrop(self, drop_data)
+                changed = True
+                if changes is not None:
+                    changes.added_drops.add(drop.id)
+            elif drop.update(drop_data):
+                changed = True
+                if changes is not None:
+                    changes.changed_drops.add(drop.id)
+            drops.append(drop)
+
+        new_ids = {drop.id for drop in drops}
+        for drop_id in self.timed_drops.keys() - new_ids:
+            changed = True
+            if changes is not None:
+                changes.removed_drops.add(drop_id)
+
+        self.drops = drops
+        self.timed_drops = {drop.id: drop for drop in drops}
+        if changed:
+            self.graph = DropGraph(drops)
 
         # Allowed channels
         self.allowed_channels: set = set()
@@ -137,6 +280,8 @@ class DropsCampaign:
                 # Store channel IDs
                 self.allowed_channels.add(int(ch_data["id"]))
 
+        return changed or self._state() != before
+
     @property
     def active(self) -> bool:
         """Check if campaign is currently active."""
@@ -214,3 +359,163 @@ class DropsCampaign:
 
     def __repr__(self):
         return f"DropsCampaign({self.name}, {self.claimed_drops}/{self.total_drops})"
+
+
+class InventoryChanges:
+    """Compact set of differences between two inventory refreshes."""
+
+    def __init__(self):
+        self.added_campaigns: set[str] = set()
+        self.removed_campaigns: set[str] = set()
+        self.changed_campaigns: set[str] = set()
+        self.added_drops: set[str] = set()
+        self.removed_drops: set[str] = set()
+        self.changed_drops: set[str] = set()
+
+    def __bool__(self):
+        return bool(
+            self.added_campaigns or self.removed_campaigns or self.changed_campaigns
+            or self.added_drops or self.removed_drops or self.changed_drops
+        )
+
+    def __repr__(self):
+        return (
+            f"InventoryChanges(campaigns +{len(self.added_campaigns)} -{len(self.removed_campaigns)} "
+            f"~{len(self.changed_campaigns)}, drops +{len(self.added_drops)} "
+            f"-{len(self.removed_drops)} ~{len(self.changed_drops)})"
+        )
+
+
+class InventoryIndex:
+    """Lookup tables over the inventory, for O(1) routing of drop events.
+
+    Maintained by `reconcile` on every inventory refresh, so it never points
+    at campaigns that are no longer in the inventory.
+    """
+
+    def __init__(self):
+        self.campaigns: dict[str, DropsCampaign] = {}
+        self.drops: dict[str, TimedDrop] = {}
+        self.games: dict[int, list[DropsCampaign]] = {}
+        self.claim_ids: dict[str, TimedDrop] = {}
+
+    def clear(self):
+        self.campaigns.clear()
+        self.drops.clear()
+        self.games.clear()
+        self.claim_ids.clear()
+
+    def add(self, campaign: DropsCampaign):
+        self.campaigns[campaign.id] = campaign
+        self.games.setdefault(campaign.game.id, []).append(campaign)
+        for drop in campaign.drops:
+            self.drops[drop.id] = drop
+            if drop.claim_id:
+                self.claim_ids[drop.claim_id] = drop
+
+    def remove(self, campaign: DropsCampaign):
+        if self.campaigns.pop(campaign.id, None) is None:
+            return
+        game_campaigns = self.games.get(campaign.game.id, [])
+        if campaign in game_campaigns:
+            game_campaigns.remove(campaign)
+        if not game_campaigns:
+            self.games.pop(campaign.game.id, None)
+        for drop in campaign.drops:
+            self.drops.pop(drop.id, None)
+            if drop.claim_id:
+                self.claim_ids.pop(drop.claim_id, None)
+
+    def get_drop(self, drop_id: Optional[str] = None, claim_id: Optional[str] = None) -> Optional[TimedDrop]:
+        """Find a drop by its ID, or by its dropInstanceID."""
+        if claim_id and claim_id in self.claim_ids:
+            return self.claim_ids[claim_id]
+        return self.drops.get(drop_id) if drop_id else None
+
+    def get_campaign(self, campaign_id: str) -> Optional[DropsCampaign]:
+        return self.campaigns.get(campaign_id)
+
+    def game_campaigns(self, game: Game) -> list[DropsCampaign]:
+        return self.games.get(game.id, [])
+
+
+def merge_inventory(campaigns_data: list[dict], inventory_data: Optional[dict]) -> list[dict]:
+    """Join dashboard campaigns with the progress and claim state from the Inventory query.
+
+    Drops are matched by ID, the inventory's `self` edge takes precedence over the dashboard's.
+    Campaigns in progress that the dashboard doesn't list are included as well.
+    The input data is left untouched.
+    """
+    in_progress = (inventory_data or {}).get("dropCampaignsInProgress") or []
+    progress: dict[str, dict] = {}
+    for campaign_data in in_progress:
+        for drop_data in campaign_data.get("timeBasedDrops") or []:
+            if drop_data.get("self"):
+                progress[drop_data["id"]] = drop_data["self"]
+    if not progress and not in_progress:
+        return campaigns_data
+
+    merged: list[dict] = []
+    for campaign_data in campaigns_data:
+        drops_data = campaign_data.get("timeBasedDrops") or []
+        if any(drop_data["id"] in progress for drop_data in drops_data):
+            campaign_data = {
+                **campaign_data,
+                "timeBasedDrops": [
+                    {**drop_data, "self": {**(drop_data.get("self") or {}), **progress[drop_data["id"]]}}
+                    if drop_data["id"] in progress else drop_data
+                    for drop_data in drops_data
+                ],
+            }
+        merged.append(campaign_data)
+
+    known = {campaign_data["id"] for campaign_data in campaigns_data}
+    merged.extend(
+        campaign_data for campaign_data in in_progress
+        if campaign_data["id"] not in known and "game" in campaign_data
+    )
+    return merged
+
+
+def reconcile(
+    twitch: 'TwitchClient',
+    inventory: list[DropsCampaign],
+    index: InventoryIndex,
+    campaigns_data: list[dict],
+) -> InventoryChanges:
+    """Apply a fresh list of campaign data onto the existing inventory, in place.
+
+    Existing campaigns and drops are updated rather than rebuilt, so references
+    held elsewhere (like the drop being watched) stay valid. New campaigns are added,
+    the ones missing from the data are retired, and the index is kept in sync.
+    """
+    changes = InventoryChanges()
+    campaigns: list[DropsCampaign] = []
+    seen: set[str] = set()
+
+    for campaign_data in campaigns_data:
+        try:
+            campaign = index.get_campaign(campaign_data["id"])
+            if campaign is None:
+                campaign = DropsCampaign(twitch, campaign_data)
+                index.add(campaign)
+                changes.added_campaigns.add(campaign.id)
+                changes.added_drops.update(campaign.timed_drops)
+            elif campaign_data != campaign._data:
+                index.remove(campaign)
+                if campaign.update(campaign_data, changes):
+                    changes.changed_campaigns.add(campaign.id)
+                index.add(campaign)
+            campaigns.append(campaign)
+            seen.add(campaign.id)
+        except Exception as e:
+            logger.error(f"Error parsing campaign: {e}")
+
+    for campaign in inventory:
+        if campaign.id not in seen:
+            index.remove(campaign)
+            changes.removed_campaigns.add(campaign.id)
+            changes.removed_drops.update(campaign.timed_drops)
+
+    inventory[:] = campaigns
+    return changes
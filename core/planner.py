@@ -0,0 +1,294 @@
+"""Drop throughput planning"""
+import logging
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from typing import Optional, Iterable, TYPE_CHECKING
+
+from core.constants import PLANNER_REPLAN_INTERVAL
+
+if TYPE_CHECKING:
+    from core.channel import Channel
+    from core.inventory import DropsCampaign, InventoryChanges, InventoryIndex, TimedDrop
+    from core.utils import Game
+
+logger = logging.getLogger("TwitchDrops.planner")
+
+
+class _Milestone:
+    """Watching a game up to the point where one or more of its drops complete."""
+    __slots__ = ("game", "index", "minutes", "deadline", "due", "drops", "weight")
+
+    def __init__(self, game: 'Game', index: int, minutes: float, deadline: float, drops: list['TimedDrop'], weight: float):
+        self.game = game
+        self.index = index
+        # Watch time needed after the game's previous milestone
+        self.minutes = minutes
+        # Minutes from now, by which it has to be done for every drop in it to count
+        self.deadline = deadline
+        # Scheduling order: no later than the game's next milestone, so chains stay in order
+        self.due = deadline
+        self.drops = drops
+        self.weight = weight
+
+
+class PlannedDrop:
+    """A drop in the plan, with its expected completion time."""
+
+    def __init__(self, drop: 'TimedDrop', eta: datetime):
+        self.drop = drop
+        self.eta = eta
+
+    def __repr__(self):
+        return f"PlannedDrop({self.drop.name}, {self.eta:%Y-%m-%d %H:%M})"
+
+
+class PlanSegment:
+    """A stretch of time spent watching one game."""
+
+    def __init__(self, game: 'Game', starts_at: datetime):
+        self.game = game
+        self.starts_at = starts_at
+        self.ends_at = starts_at
+        self.drops: list[PlannedDrop] = []
+
+    @property
+    def campaigns(self) -> list['DropsCampaign']:
+        seen = {}
+        for planned in self.drops:
+            seen.setdefault(planned.drop.campaign.id, planned.drop.campaign)
+        return list(seen.values())
+
+    def __repr__(self):
+        return f"PlanSegment({self.game.name}, {self.starts_at:%H:%M}-{self.ends_at:%H:%M}, {len(self.drops)} drops)"
+
+
+class DropPlanner:
+    """Orders watch time across games to complete as many drops as possible before they expire.
+
+    Watching a game progresses all of its earnable drops at once, so each game is a chain
+    of milestones where drops complete. Milestones are scheduled earliest-deadline-first,
+    and whenever that makes one late, the milestone with the most watch time per drop
+    among the last scheduled one of each game is dropped (a Moore-Hodgson style pass).
+    Drops that would be late even if their game were watched right away are given up
+    before that, without holding back the rest of their game.
+    Per-game chains are cached, so a progress event only recomputes its own game.
+    """
+
+    def __init__(self):
+        # Game ID -> campaign ID -> campaign
+        self._campaigns: dict[int, dict[str, 'DropsCampaign']] = {}
+        self._games: dict[int, 'Game'] = {}
+        self._campaign_games: dict[str, int] = {}
+        # Game ID -> (completion minutes, deadline timestamp, drop), sorted by completion
+        self._chains: dict[int, list[tuple[float, float, 'TimedDrop']]] = {}
+        self._dirty_games: set[int] = set()
+        self._planned_at: Optional[datetime] = None
+        self._chains_built_at: Optional[datetime] = None
+
+        self.timeline: list[PlanSegment] = []
+        self.at_risk: list['TimedDrop'] = []
+        self.plan_time = 0.0
+
+    # Inputs
+
+    def drop_weight(self, drop: 'TimedDrop') -> float:
+        """Value of completing a drop, every drop counts the same by default."""
+        return 1.0
+
+    def update(self, campaign: 'DropsCampaign'):
+        """Mark a campaign's game for re-planning, after progress, claims or data changes."""
+        if self._campaign_games.get(campaign.id) != campaign.game.id:
+            # New, or moved to another game
+            self.remove(campaign.id)
+            self._campaigns.setdefault(campaign.game.id, {})[campaign.id] = campaign
+            self._games[campaign.game.id] = campaign.game
+            self._campaign_games[campaign.id] = campaign.game.id
+        self._dirty_games.add(campaign.game.id)
+
+    def remove(self, campaign_id: str):
+        game_id = self._campaign_games.pop(campaign_id, None)
+        if game_id is not None:
+            del self._campaigns[game_id][campaign_id]
+            self._dirty_games.add(game_id)
+
+    def apply_changes(self, changes: 'InventoryChanges', index: 'InventoryIndex'):
+        """Apply an inventory refresh change set."""
+        for campaign_id in changes.removed_campaigns:
+            self.remove(campaign_id)
+        for campaign_id in changes.added_campaigns | changes.changed_campaigns:
+            campaign = index.get_campaign(campaign_id)
+            if campaign is not None:
+                self.update(campaign)
+
+    # Planning
+
+    def _build_chain(self, game_id: int, now: datetime) -> list[tuple[float, float, 'TimedDrop']]:
+        chain = []
+        for campaign in self._campaigns.get(game_id, {}).values():
+            if not campaign.eligible or campaign.ends_at <= now:
+                continue
+            # Minutes of watching until each drop completes. A locked drop only starts
+            # progressing once its preconditions are done, so those come first.
+            completion: dict[str, float] = {}
+            for drop_id in campaign.graph.order:
+                drop = campaign.get_drop(drop_id)
+                if drop.is_claimed:
+                    continue
+                start = max(
+                    (completion.get(precondition.id, 0.0) for precondition in campaign.graph.preconditions(drop)),
+                    default=0.0,
+                )
+                completion[drop_id] = start + drop.remaining_minutes
+                if drop.is_complete or not drop.active:
+                    continue
+                deadline = min(drop.ends_at, campaign.ends_at).timestamp()
+                chain.append((completion[drop_id], deadline, drop))
+        chain.sort(key=lambda item: item[0])
+        return chain
+
+    def _milestones(self, now: datetime) -> tuple[list[_Milestone], list['TimedDrop']]:
+        """Every game's milestones, and the drops that can't be completed in time even if watched right away."""
+        now_ts = now.timestamp()
+        milestones = []
+        lost = []
+        for game_id, chain in self._chains.items():
+            game = self._games[game_id]
+            game_milestones: list[_Milestone] = []
+            previous = 0.0
+            i = 0
+            while i < len(chain):
+                # Drops completing at the same point share one milestone
+                minutes = chain[i][0]
+                drops = []
+                deadline = float("inf")
+                while i < len(chain) and chain[i][0] == minutes:
+                    drop_deadline = (chain[i][1] - now_ts) / 60
+                    if drop_deadline < minutes:
+                        lost.append(chain[i][2])
+                    else:
+                        drops.append(chain[i][2])
+                        deadline = min(deadline, drop_deadline)
+                    i += 1
+                if not drops:
+                    # The watch time still counts towards the game's next milestone
+                    continue
+                game_milestones.append(_Milestone(
+                    game, len(game_milestones), minutes - previous, deadline, drops,
+                    sum(self.drop_weight(drop) for drop in drops),
+                ))
+                previous = minutes
+            # Milestones of a game happen in order, so an earlier one is scheduled no later than the next
+            for k in range(len(game_milestones) - 2, -1, -1):
+                game_milestones[k].due = min(game_milestones[k].due, game_milestones[k + 1].due)
+            milestones.extend(game_milestones)
+        return milestones, lost
+
+    def plan(self, now: Optional[datetime] = None) -> list[PlanSegment]:
+        """Return the plan, recomputing it only if something changed or it's gotten old."""
+        if now is None:
+            now = datetime.now(timezone.utc)
+        stale = self._chains_built_at is None or now - self._chains_built_at >= PLANNER_REPLAN_INTERVAL
+        if self._planned_at is not None and not stale and not self._dirty_games:
+            return self.timeline
+
+        start = perf_counter()
+        if stale:
+            # Drops start and end over time, so every chain gets rebuilt once in a while
+            self._dirty_games = set(self._games)
+            self._chains_built_at = now
+        for game_id in self._dirty_games:
+            chain = self._build_chain(game_id, now)
+            if chain:
+                self._chains[game_id] = chain
+            else:
+                self._chains.pop(game_id, None)
+        self._dirty_games.clear()
+
+        milestones, lost = self._milestones(now)
+        milestones.sort(key=lambda m: (m.due, m.game.id, m.index))
+
+        scheduled: list[_Milestone] = []
+        rejected: list[_Milestone] = []
+        blocked: set[int] = set()
+        # Per game, the last scheduled milestone: only those can be dropped without breaking a chain
+        tails: dict[int, _Milestone] = {}
+        elapsed = 0.0
+        for milestone in milestones:
+            game_id = milestone.game.id
+            if game_id in blocked:
+                # An earlier milestone of this game was dropped, the later ones need its watch time too
+                rejected.append(milestone)
+                continue
+            scheduled.append(milestone)
+            tails[game_id] = milestone
+            elapsed += milestone.minutes
+            while elapsed > milestone.deadline and tails:
+                worst = max(tails.values(), key=lambda m: (m.minutes / m.weight, m.deadline))
+                scheduled.remove(worst)
+                rejected.append(worst)
+                elapsed -= worst.minutes
+                blocked.add(worst.game.id)
+                del tails[worst.game.id]
+
+        self.timeline = self._build_timeline(scheduled, now)
+        self.at_risk = lost + [drop for milestone in rejected for drop in milestone.drops]
+        self._planned_at = now
+        self.plan_time = perf_counter() - start
+        return self.timeline
+
+    @staticmethod
+    def _build_timeline(scheduled: list[_Milestone], now: datetime) -> list[PlanSegment]:
+        timeline: list[PlanSegment] = []
+        elapsed = 0.0
+        for milestone in scheduled:
+            if not timeline or timeline[-1].game != milestone.game:
+                timeline.append(PlanSegment(milestone.game, now + timedelta(minutes=elapsed)))
+            elapsed += milestone.minutes
+            segment = timeline[-1]
+            segment.ends_at = now + timedelta(minutes=elapsed)
+            segment.drops.extend(PlannedDrop(drop, segment.ends_at) for drop in milestone.drops)
+        return timeline
+
+    # Queries
+
+    def next_campaign(self, exclude_games: Iterable[int] = ()) -> Optional['DropsCampaign']:
+        """Campaign to work on now, the one whose drop completes first in the plan, skipping the given games."""
+        exclude_games = set(exclude_games)
+        for segment in self.plan():
+            if segment.game.id not in exclude_games:
+                return segment.drops[0].drop.campaign
+        return None
+
+    def best(self, channel: 'Channel') -> Optional['DropsCampaign']:
+        """Earliest planned campaign that can be earned on the channel."""
+        for segment in self.plan():
+            for planned in segment.drops:
+                if planned.drop.campaign.can_earn(channel):
+                    return planned.drop.campaign
+        return None
+
+    def next_drop(self, campaign: 'DropsCampaign') -> Optional['TimedDrop']:
+        """The campaign's drop that completes first in the plan."""
+        for segment in self.plan():
+            for planned in segment.drops:
+                if planned.drop.campaign is campaign:
+                    return planned.drop
+        return None
+
+    def eta(self, drop: 'TimedDrop') -> Optional[datetime]:
+        for segment in self.plan():
+            for planned in segment.drops:
+                if planned.drop is drop:
+                    return planned.eta
+        return None
+
+    def log_plan(self):
+        timeline = self.plan()
+        logger.info(
+            f"Plan: {sum(len(segment.drops) for segment in timeline)} drops in {len(timeline)} segments, "
+            f"{len(self.at_risk)} at risk ({self.plan_time * 1000:.1f} ms)"
+        )
+        for segment in timeline:
+            logger.debug(f"  {segment!r}: {', '.join(repr(planned) for planned in segment.drops)}")
+        for drop in self.at_risk:
+            logger.debug(f"  at risk: {drop!r} ({drop.campaign.game.name}, ends {drop.ends_at:%Y-%m-%d %H:%M})")
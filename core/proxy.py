@@ -0,0 +1,153 @@
+"""Proxy selection and health tracking"""
+import asyncio
+import logging
+import re
+from time import monotonic, perf_counter, time
+from typing import Optional, TYPE_CHECKING
+
+import aiohttp
+
+from core.constants import (
+    PROXY_CHECK_URL, PROXY_CHECK_INTERVAL, PROXY_CHECK_TIMEOUT, PROXY_MAX_FAILURES, PROXY_LATENCY_ALPHA
+)
+
+if TYPE_CHECKING:
+    from core.twitch_client import TwitchClient
+
+logger = logging.getLogger("TwitchDrops.proxy")
+
+
+class Proxy:
+    """A single proxy with its health and latency stats."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.successes = 0
+        self.total_failures = 0
+        self.last_check = 0.0
+        self.last_failure = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return self.failures < PROXY_MAX_FAILURES
+
+    def record_success(self, latency: float):
+        """Fold a latency sample into the moving average."""
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += PROXY_LATENCY_ALPHA * (latency - self.latency)
+        self.failures = 0
+        self.successes += 1
+
+    def record_failure(self):
+        self.failures += 1
+        self.total_failures += 1
+        self.last_failure = monotonic()
+        if self.failures == PROXY_MAX_FAILURES:
+            logger.warning(f"Proxy {self.url} marked unhealthy")
+
+    def __repr__(self):
+        latency = f"{self.latency * 1000:.0f}ms" if self.latency is not None else "?"
+        return f"Proxy({self.url}, {latency}, {'healthy' if self.healthy else 'unhealthy'})"
+
+
+class ProxyPool:
+    """Picks the fastest healthy proxy for GQL and websocket connections.
+
+    Latency comes from both periodic health checks and real requests,
+    so a degrading proxy loses its place and traffic fails over to the next one.
+    """
+
+    def __init__(self, twitch: 'TwitchClient', urls: Optional[list[str]] = None):
+        self._twitch = twitch
+        self.check_url = PROXY_CHECK_URL
+        self.proxies: dict[str, Proxy] = {}
+        self._check_task: Optional[asyncio.Task] = None
+        self.update(urls or [])
+
+    @staticmethod
+    def parse(spec: str) -> list[str]:
+        """Split the `Settings.proxy` string into proxy URLs, separated by commas or whitespace."""
+        return [url for url in re.split(r"[,\s]+", spec or "") if url]
+
+    def update(self, urls: list[str]):
+        """Replace the proxy list, keeping the stats of proxies that remain."""
+        self.proxies = {url: self.proxies.get(url) or Proxy(url) for url in urls}
+
+    def select(self) -> Optional[str]:
+        """URL of the proxy to use, or None to connect directly."""
+        if not self.proxies:
+            return None
+        candidates = [p for p in self.proxies.values() if p.healthy]
+        if not candidates:
+            # Everything is failing, fall back to whichever failed least recently
+            return min(self.proxies.values(), key=lambda p: p.last_failure).url
+        # Untested proxies go last among the healthy ones, but still before unhealthy ones
+        return min(
+            candidates, key=lambda p: p.latency if p.latency is not None else float("inf")
+        ).url
+
+    def report(self, url: Optional[str], latency: Optional[float]):
+        """Record the outcome of a request made through a proxy, None latency means failure."""
+        proxy = self.proxies.get(url) if url else None
+        if proxy is None:
+            return
+        if latency is None:
+            proxy.record_failure()
+        else:
+            proxy.record_success(latency)
+
+    async def check(self, proxy: Proxy):
+        """Health check a single proxy."""
+        session = await self._twitch.get_session()
+        proxy.last_check = time()
+        start = perf_counter()
+        try:
+            async with session.head(
+                self.check_url,
+                proxy=proxy.url,
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(total=PROXY_CHECK_TIMEOUT.total_seconds()),
+            ) as response:
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.debug(f"Proxy {proxy.url} health check failed: {e}")
+            proxy.record_failure()
+        else:
+            proxy.record_success(perf_counter() - start)
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(proxy) for proxy in list(self.proxies.values())))
+
+    async def _check_loop(self):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(PROXY_CHECK_INTERVAL.total_seconds())
+
+    def start(self):
+        """Start periodic health checks, if there are any proxies to check."""
+        if self.proxies and self._check_task is None:
+            self._check_task = asyncio.create_task(self._check_loop())
+
+    async def stop(self):
+        if self._check_task is not None:
+            self._check_task.cancel()
+            try:
+                await self._check_task
+            except asyncio.CancelledError:
+                pass
+            self._check_task = None
+
+    def stats(self) -> dict[str, dict]:
+        return {
+            url: {
+                "latency": proxy.latency,
+                "healthy": proxy.healthy,
+                "successes": proxy.successes,
+                "failures": proxy.total_failures,
+            }
+            for url, proxy in self.proxies.items()
+        }
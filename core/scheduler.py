@@ -0,0 +1,231 @@
+"""Campaign scheduling"""
+import heapq
+import logging
+from itertools import count
+from time import time
+from typing import Optional, Iterable, TYPE_CHECKING
+
+from core.constants import PriorityMode, SCHEDULER_REKEY_INTERVAL
+
+if TYPE_CHECKING:
+    from core.channel import Channel
+    from core.inventory import DropsCampaign, InventoryChanges, InventoryIndex
+    from core.settings import Settings
+
+logger = logging.getLogger("TwitchDrops.scheduler")
+
+# Heap entries are (key, seq, version, campaign), where seq keeps inventory order between equal keys
+# and version invalidates the entries of a campaign that got updated or removed since.
+_Entry = tuple[float, int, int, 'DropsCampaign']
+# Heaps are per (game ID, channel ID): a game ID of None holds every game, for channels
+# without a known game, and a channel ID of None holds campaigns without channel restrictions.
+_HeapKey = tuple[Optional[int], Optional[int]]
+
+_NOT_PRIORITIZED = 999999
+
+# Modes with a heap of their own, the others are served by the ENDING_SOONEST heaps
+SCHEDULED_MODES = (PriorityMode.PRIORITY_ONLY, PriorityMode.ENDING_SOONEST, PriorityMode.LOW_AVAILABILITY)
+
+
+class CampaignScheduler:
+    """Keeps earnable campaigns in per-PriorityMode heaps, to pick the best one quickly.
+
+    Heaps are invalidated lazily: updating or removing a campaign bumps its version,
+    and stale entries are dropped when they reach the top. Campaigns that can't be earned yet
+    wait in a separate heap ordered by the time they may become earnable.
+    """
+
+    def __init__(self, settings: 'Settings'):
+        self._settings = settings
+        self._heaps: dict[PriorityMode, dict[_HeapKey, list[_Entry]]] = {mode: {} for mode in SCHEDULED_MODES}
+        self._pending: list[_Entry] = []
+        self._versions: dict[str, int] = {}
+        self._seq: dict[str, int] = {}
+        self._scheduled: dict[str, 'DropsCampaign'] = {}
+        self._counter = count()
+        self._priority: dict[str, int] = {}
+        self._priority_list: list[str] = []
+        self._rekeyed = time()
+        self._sync_priority()
+
+    # Keys
+
+    def _sync_priority(self) -> bool:
+        """Pick up priority list changes from settings. Returns True if it changed."""
+        if self._settings.priority == self._priority_list:
+            return False
+        self._priority_list = list(self._settings.priority)
+        self._priority = {}
+        for i, name in enumerate(self._priority_list):
+            # Same as list.index, the first occurrence wins
+            self._priority.setdefault(name, i)
+        return True
+
+    def _key(self, mode: PriorityMode, campaign: 'DropsCampaign') -> float:
+        if mode == PriorityMode.ENDING_SOONEST:
+            return campaign.ends_at.timestamp()
+        if mode == PriorityMode.LOW_AVAILABILITY:
+            return campaign.availability
+        return self._priority.get(campaign.game.name, _NOT_PRIORITIZED)
+
+    @staticmethod
+    def _heap_keys(campaign: 'DropsCampaign') -> Iterable[_HeapKey]:
+        for game_id in (campaign.game.id, None):
+            if campaign.allowed_channels:
+                for channel_id in campaign.allowed_channels:
+                    yield game_id, channel_id
+            else:
+                yield game_id, None
+
+    # Maintenance
+
+    def _push(self, campaign: 'DropsCampaign', version: int, modes: Iterable[PriorityMode] = SCHEDULED_MODES):
+        seq = self._seq[campaign.id]
+        for mode in modes:
+            heaps = self._heaps[mode]
+            key = self._key(mode, campaign)
+            for heap_key in self._heap_keys(campaign):
+                heapq.heappush(heaps.setdefault(heap_key, []), (key, seq, version, campaign))
+        self._scheduled[campaign.id] = campaign
+
+    def _defer(self, campaign: 'DropsCampaign', now: float):
+        """Park a campaign that can't be earned right now, until it might be."""
+        self._scheduled.pop(campaign.id, None)
+        version = self._versions[campaign.id] = self._versions.get(campaign.id, 0) + 1
+        ends_at = campaign.ends_at.timestamp()
+        if not campaign.eligible or ends_at <= now:
+            return
+        upcoming = [
+            drop.starts_at.timestamp() for drop in campaign.drops
+            if not drop.is_claimed and not drop.is_complete and drop.starts_at.timestamp() > now
+        ]
+        starts_at = campaign.starts_at.timestamp()
+        if starts_at > now:
+            upcoming.append(starts_at)
+        if upcoming and min(upcoming) < ends_at:
+            heapq.heappush(self._pending, (min(upcoming), self._seq[campaign.id], version, campaign))
+
+    def _add(self, campaign: 'DropsCampaign', now: float):
+        if campaign.id not in self._seq:
+            self._seq[campaign.id] = next(self._counter)
+        if campaign.can_earn():
+            self._push(campaign, self._versions.setdefault(campaign.id, 0))
+        else:
+            self._defer(campaign, now)
+
+    def update(self, campaign: 'DropsCampaign'):
+        """Re-evaluate a campaign after its drops progressed, got claimed, or its data changed."""
+        if campaign.id in self._scheduled and campaign.can_earn():
+            # Still earnable, and none of the keys depend on drop progress
+            return
+        self._versions[campaign.id] = self._versions.get(campaign.id, 0) + 1
+        self._scheduled.pop(campaign.id, None)
+        self._add(campaign, time())
+
+    def remove(self, campaign_id: str):
+        # The version stays behind as a tombstone: a campaign coming back with the same ID
+        # must not revive the heap entries of the object it replaced
+        if campaign_id in self._versions:
+            self._versions[campaign_id] += 1
+        self._seq.pop(campaign_id, None)
+        self._scheduled.pop(campaign_id, None)
+
+    def rebuild(self, campaigns: Iterable['DropsCampaign']):
+        self._heaps = {mode: {} for mode in SCHEDULED_MODES}
+        self._pending.clear()
+        self._versions.clear()
+        self._seq.clear()
+        self._scheduled.clear()
+        now = time()
+        for campaign in campaigns:
+            self._add(campaign, now)
+        self._rekeyed = now
+
+    def apply_changes(self, changes: 'InventoryChanges', index: 'InventoryIndex'):
+        """Apply an inventory refresh change set."""
+        for campaign_id in changes.removed_campaigns:
+            self.remove(campaign_id)
+        for campaign_id in changes.added_campaigns | changes.changed_campaigns:
+            campaign = index.get_campaign(campaign_id)
+            if campaign is not None:
+                self._versions[campaign_id] = self._versions.get(campaign_id, 0) + 1
+                self._scheduled.pop(campaign_id, None)
+                self._add(campaign, time())
+
+    def _rekey(self, mode: PriorityMode):
+        """Rebuild the heaps of one mode from the currently scheduled campaigns."""
+        self._heaps[mode] = {}
+        for campaign in self._scheduled.values():
+            self._push(campaign, self._versions[campaign.id], (mode,))
+
+    def _advance(self, now: float):
+        """Move campaigns whose waiting time is over back into the heaps."""
+        while self._pending and self._pending[0][0] <= now:
+            _, _, version, campaign = heapq.heappop(self._pending)
+            if self._versions.get(campaign.id) == version:
+                self._add(campaign, now)
+
+    # Queries
+
+    def _top(self, heap: Optional[list[_Entry]], channel: 'Channel', now: float) -> Optional[_Entry]:
+        while heap:
+            entry = heap[0]
+            campaign = entry[3]
+            if self._versions.get(campaign.id) != entry[2]:
+                heapq.heappop(heap)
+            elif campaign.can_earn(channel):
+                return entry
+            else:
+                # The heap already matches game and channel, so this isn't channel specific
+                heapq.heappop(heap)
+                self._defer(campaign, now)
+        return None
+
+    def _prepare(self, mode: Optional[PriorityMode], now: float) -> PriorityMode:
+        """Resolve the mode to use, and bring its keys up to date."""
+        self._advance(now)
+        if mode is None:
+            mode = self._settings.priority_mode
+        if mode not in self._heaps:
+            mode = PriorityMode.ENDING_SOONEST
+        if mode == PriorityMode.PRIORITY_ONLY and self._sync_priority():
+            self._rekey(mode)
+        elif mode == PriorityMode.LOW_AVAILABILITY and now - self._rekeyed >= SCHEDULER_REKEY_INTERVAL.total_seconds():
+            # Availability decreases at a different rate for every campaign, so the order drifts
+            self._rekey(mode)
+            self._rekeyed = now
+        return mode
+
+    def best(self, channel: 'Channel', mode: Optional[PriorityMode] = None) -> Optional['DropsCampaign']:
+        """The best campaign to earn on the channel, according to the priority mode."""
+        now = time()
+        mode = self._prepare(mode, now)
+        heaps = self._heaps[mode]
+        game_id = channel.game.id if channel.game else None
+        best: Optional[_Entry] = None
+        for heap_key in ((game_id, None), (game_id, channel.id)):
+            top = self._top(heaps.get(heap_key), channel, now)
+            if top is not None and (best is None or top[:2] < best[:2]):
+                best = top
+        return best[3] if best is not None else None
+
+    def next_campaign(
+        self, exclude_games: Iterable[int] = (), mode: Optional[PriorityMode] = None
+    ) -> Optional['DropsCampaign']:
+        """The best campaign to earn on any channel, skipping the given games.
+
+        This scans every scheduled campaign, it's meant for picking what to watch next.
+        """
+        mode = self._prepare(mode, time())
+        exclude_games = set(exclude_games)
+        best = None
+        for campaign in self._scheduled.values():
+            if campaign.game.id in exclude_games or not campaign.can_earn():
+                continue
+            key = (self._key(mode, campaign), self._seq[campaign.id])
+            if best is None or key < best[0]:
+                best = (key, campaign)
+        return best[1] if best is not None else None
+
+    def __len__(self) -> int:
+        return len(self._scheduled)
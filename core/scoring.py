@@ -0,0 +1,120 @@
+"""Channel scoring"""
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Iterable, TYPE_CHECKING
+
+from core.constants import CHANNEL_URGENCY_WEIGHT
+
+if TYPE_CHECKING:
+    from core.channel import Channel
+    from core.inventory import DropsCampaign, TimedDrop
+    from core.utils import Game
+
+logger = logging.getLogger("TwitchDrops.scoring")
+
+
+class _Snapshot:
+    """One directory listing of a game, with the campaigns each of its channels qualifies for."""
+    __slots__ = ("channels", "qualifies", "values", "ranking")
+
+    def __init__(self, channels: list['Channel']):
+        self.channels = channels
+        # Channel ID -> campaigns that can be earned on it
+        self.qualifies: dict[int, list['DropsCampaign']] = {}
+        # Campaign values the ranking was computed with
+        self.values: Optional[tuple[float, ...]] = None
+        self.ranking: list[tuple[float, 'Channel']] = []
+
+
+class ChannelScorer:
+    """Ranks live channels by how much drop progress watching them makes.
+
+    Watching a channel progresses every campaign that can be earned on it, so a channel
+    is worth the sum of its campaigns' values: each earnable drop counts once, plus extra
+    the closer it is to running out of time. Which campaigns a channel qualifies for is
+    worked out once per directory snapshot. After that, re-scoring only recomputes the
+    campaign values, and reuses the ranking if none of them changed.
+    """
+
+    def __init__(self):
+        self._snapshots: dict[int, _Snapshot] = {}
+
+    @staticmethod
+    def drop_value(drop: 'TimedDrop', now: datetime) -> float:
+        minutes_left = (min(drop.ends_at, drop.campaign.ends_at) - now).total_seconds() / 60
+        if minutes_left <= 0:
+            return 0.0
+        # 0 when there's plenty of time, 1 when the drop needs all the time that's left
+        urgency = min(1.0, drop.remaining_minutes / minutes_left)
+        return 1.0 + CHANNEL_URGENCY_WEIGHT * urgency
+
+    def campaign_value(self, campaign: 'DropsCampaign', now: datetime) -> float:
+        return sum(self.drop_value(drop, now) for drop in campaign.drops if drop.can_earn())
+
+    def snapshot(self, game: 'Game', channels: list['Channel'], campaigns: Iterable['DropsCampaign']):
+        """Register a fresh directory listing for the game, replacing the previous one."""
+        snapshot = _Snapshot(channels)
+        campaigns = list(campaigns)
+        for channel in channels:
+            qualifies = [campaign for campaign in campaigns if campaign.can_earn(channel)]
+            if qualifies:
+                snapshot.qualifies[channel.id] = qualifies
+        self._snapshots[game.id] = snapshot
+
+    def invalidate(self, game: Optional['Game'] = None):
+        if game is None:
+            self._snapshots.clear()
+        else:
+            self._snapshots.pop(game.id, None)
+
+    def rank(self, game: 'Game') -> list[tuple[float, 'Channel']]:
+        """(score, channel) pairs of the game's last snapshot, best first, skipping worthless channels."""
+        snapshot = self._snapshots.get(game.id)
+        if snapshot is None:
+            return []
+        now = datetime.now(timezone.utc)
+        campaigns: dict[str, 'DropsCampaign'] = {}
+        for qualifies in snapshot.qualifies.values():
+            for campaign in qualifies:
+                campaigns.setdefault(campaign.id, campaign)
+        values = {campaign_id: self.campaign_value(campaign, now) for campaign_id, campaign in campaigns.items()}
+        # Urgency creeps up with time, so values are rounded to keep reusing the ranking meanwhile
+        key = tuple(round(value, 2) for value in values.values())
+        if key == snapshot.values:
+            return snapshot.ranking
+
+        ranking = []
+        for channel in snapshot.channels:
+            qualifies = snapshot.qualifies.get(channel.id)
+            if not qualifies:
+                continue
+            score = sum(values[campaign.id] for campaign in qualifies)
+            if score > 0:
+                ranking.append((score, channel))
+        # Viewer count breaks ties, bigger streams are less likely to go offline
+        ranking.sort(key=lambda item: (item[0], item[1].viewers), reverse=True)
+        snapshot.values = key
+        snapshot.ranking = ranking
+        return ranking
+
+    def best(self, game: 'Game', count: int = 1) -> list['Channel']:
+        """The best channels of the game still known to be live on it, at most `count` of them."""
+        best = []
+        for score, channel in self.rank(game):
+            # Stream state events may have changed these since the snapshot,
+            # and there's no watching a stream without its broadcast ID
+            if (
+                not channel.online
+                or channel.broadcast_id is None
+                or (channel.game is not None and channel.game != game)
+            ):
+                continue
+            if not best:
+                logger.debug(
+                    f"Best channel for {game.name}: {channel.login} (score {score:.2f}, "
+                    f"{len(self._snapshots[game.id].qualifies[channel.id])} campaigns)"
+                )
+            best.append(channel)
+            if len(best) >= count:
+                break
+        return best
@@ -1,7 +1,7 @@
 """Settings management"""
-import json
 import os
 from pathlib import Path
+from core import codec
 from core.constants import PriorityMode
 
 # Android storage path
@@ -28,6 +28,8 @@ class Settings:
         self.language = "English"
         self.priority_mode = PriorityMode.PRIORITY_ONLY
         self.proxy = ""
+        # Channels watched at the same time, each on a different game
+        self.watch_sessions = 2
         self.auto_claim = True
         self.notifications_enabled = True
         self._altered = False
@@ -39,7 +41,7 @@ class Settings:
         if SETTINGS_PATH.exists():
             try:
                 with open(SETTINGS_PATH, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                    data = codec.loads(f.read())
                     self.oauth_token = data.get('oauth_token', '')
                     self.user_id = data.get('user_id')
                     self.username = data.get('username', '')
@@ -48,6 +50,7 @@ class Settings:
                     self.language = data.get('language', 'English')
                     self.priority_mode = PriorityMode(data.get('priority_mode', 'priority_only'))
                     self.proxy = data.get('proxy', '')
+                    self.watch_sessions = data.get('watch_sessions', 2)
                     self.auto_claim = data.get('auto_claim', True)
                     self.notifications_enabled = data.get('notifications_enabled', True)
             except Exception as e:
@@ -66,11 +69,12 @@ class Settings:
                     'language': self.language,
                     'priority_mode': self.priority_mode.value,
                     'proxy': self.proxy,
+                    'watch_sessions': self.watch_sessions,
                     'auto_claim': self.auto_claim,
                     'notifications_enabled': self.notifications_enabled,
                 }
                 with open(SETTINGS_PATH, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, indent=2)
+                    f.write(codec.dumps_pretty(data))
                 self._altered = False
             except Exception as e:
                 print(f"Error saving settings: {e}")
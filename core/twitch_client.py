@@ -1,24 +1,35 @@
 """Main Twitch client for drops mining"""
 import asyncio
 import logging
-import json
+from time import perf_counter
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Callable, Any
+from typing import Optional, Callable, Any, Iterable, AsyncIterator
 
 import aiohttp
 
 from core.constants import (
-    CLIENT_ID, USER_AGENT, GQL_URL, GQL_OPERATIONS,
-    State, PriorityMode, WATCH_INTERVAL
+    CLIENT_ID, USER_AGENT, GQL_OPERATIONS, GQLOperation,
+    State, PriorityMode, DIRECTORY_PAGE_SIZE, DIRECTORY_MAX_PAGES, CHANNEL_BACKUPS
 )
 from core.exceptions import (
-    MinerException, LoginException, GQLException,
+    MinerException, LoginException,
     CaptchaRequired, ExitRequest
 )
 from core.utils import create_nonce, timestamp, Game, AwaitableValue, ExponentialBackoff
 from core.settings import Settings
+from core.connection import ConnectionPool
+from core.discovery import DirectoryDiscovery
+from core.proxy import ProxyPool
+from core.heartbeat import HeartbeatEngine
+from core.gql import GQLBatcher, GQLHedger, GQLRetrier, GQLCache, SingleFlight
+from core.planner import DropPlanner
+from core.scheduler import CampaignScheduler
+from core.scoring import ChannelScorer
+from core.watcher import WatcherPool
 from core.websocket_client import WebsocketPool
-from core.inventory import DropsCampaign, TimedDrop
+from core.inventory import (
+    DropsCampaign, TimedDrop, InventoryIndex, InventoryChanges, merge_inventory, reconcile
+)
 from core.channel import Channel
 
 logger = logging.getLogger("TwitchDrops")
@@ -35,20 +46,33 @@ class TwitchClient:
         self.state = State.IDLE
         self._running = False
         self._session: Optional[aiohttp.ClientSession] = None
+        self.connection_pool = ConnectionPool()
+        self.proxy_pool = ProxyPool(self, ProxyPool.parse(settings.proxy))
+        self._gql = GQLBatcher(self)
+        self.gql_hedger = GQLHedger(self._gql)
+        self.gql_retrier = GQLRetrier(self.gql_hedger)
+        self.gql_cache = GQLCache()
+        self.gql_flight = SingleFlight()
+        self.heartbeat = HeartbeatEngine(self)
         self._logged_in = AwaitableValue()
 
         # Data
         self.inventory: list[DropsCampaign] = []
-        self.channels: dict[str, Channel] = {}
-        self.watching_channel: Optional[Channel] = None
-        self.current_drop: Optional[TimedDrop] = None
+        self.inventory_index = InventoryIndex()
+        self.inventory_timings: dict[str, float] = {}
+        self.scheduler = CampaignScheduler(settings)
+        self.planner = DropPlanner()
+        self.scorer = ChannelScorer()
+        self.discovery = DirectoryDiscovery(self)
+        # Channel ID -> the one object kept up to date for it, by directory listings and PubSub events
+        self.channels: dict[int, Channel] = {}
+        self.watchers = WatcherPool(self, settings.watch_sessions)
         self.games: set[Game] = set()
 
         # Websocket
         self.websocket_pool: Optional[WebsocketPool] = None
 
         # Tasks
-        self._watch_task: Optional[asyncio.Task] = None
         self._maintenance_task: Optional[asyncio.Task] = None
 
     # ========================================================================
@@ -83,9 +107,12 @@ class TwitchClient:
         """Update current drop in UI."""
         self._callback('on_drop', drop)
 
-    def update_inventory(self):
-        """Update inventory in UI."""
-        self._callback('on_inventory', self.inventory)
+    def update_inventory(self, changes: Optional[InventoryChanges] = None):
+        """Update inventory in UI, incrementally if given changes and the UI supports it."""
+        if changes is not None and self.callbacks.get('on_inventory_changes'):
+            self._callback('on_inventory_changes', self.inventory, changes)
+        else:
+            self._callback('on_inventory', self.inventory)
 
     def notify(self, title: str, message: str):
         """Show notification."""
@@ -105,11 +132,26 @@ class TwitchClient:
             if self.settings.oauth_token:
                 headers['Authorization'] = f'OAuth {self.settings.oauth_token}'
 
-            self._session = aiohttp.ClientSession(headers=headers)
+            self._session = self.connection_pool.session(headers)
         return self._session
 
+    async def prewarm(self):
+        """Open connections to Twitch ahead of the first request.
+
+        Uses a session of its own: the shared one carries the OAuth token,
+        which may not be set yet at startup.
+        """
+        session = self.connection_pool.session({'Client-ID': CLIENT_ID, 'User-Agent': USER_AGENT})
+        try:
+            await self.connection_pool.prewarm(session, proxy=self.proxy_pool.select())
+        finally:
+            # The warm connections belong to the shared connector and stay open
+            await session.close()
+
     async def close_session(self):
-        """Close aiohttp session."""
+        """Close aiohttp session, the pooled connections stay open."""
+        await self._gql.close()
+        await self.heartbeat.close()
         if self._session and not self._session.closed:
             await self._session.close()
             self._session = None
@@ -118,30 +160,35 @@ class TwitchClient:
     # GQL REQUESTS
     # ========================================================================
 
-    async def gql_request(self, operation: dict) -> dict:
-        """Make a GraphQL request to Twitch."""
-        session = await self.get_session()
-
-        payload = {
-            "operationName": operation["operationName"],
-            "extensions": operation["extensions"],
-            "variables": operation.get("variables", {})
-        }
-
-        try:
-            async with session.post(GQL_URL, json=payload) as response:
-                if response.status == 401:
-                    raise LoginException("Authentication failed")
-
-                data = await response.json()
-
-                if "errors" in data:
-                    error_msg = data["errors"][0]["message"]
-                    raise GQLException(error_msg)
-
-                return data
-        except aiohttp.ClientError as e:
-            raise MinerException(f"Network error: {e}")
+    async def gql_request(self, operation: GQLOperation) -> dict:
+        """Make a GraphQL request to Twitch.
+
+        Read-only operations are served from the response cache while fresh.
+        Identical operations already in flight are awaited instead of being sent again.
+        Transient failures are retried with backoff, within the operation's retry budget.
+        Slow idempotent operations may get hedged with a duplicate request.
+        Requests issued within a short window of each other are sent together
+        as a single batch, each caller still gets only its own result.
+        """
+        cacheable = self.gql_cache.cacheable(operation)
+        if cacheable:
+            cached = self.gql_cache.get(operation)
+            if cached is not None:
+                return cached
+
+        response = await self.gql_flight.run(
+            operation.key, lambda: self.gql_retrier.request(operation)
+        )
+
+        if cacheable:
+            self.gql_cache.put(operation, response)
+        return response
+
+    def invalidate_channel(self, channel: Channel):
+        """Drop cached responses that describe the channel's stream state."""
+        self.gql_cache.invalidate("StreamMetadata", channelLogin=channel.login)
+        if channel.game is not None:
+            self.gql_cache.invalidate("DirectoryPage_Game", slug=channel.game.slug)
 
     # ========================================================================
     # AUTHENTICATION
@@ -157,18 +204,7 @@ class TwitchClient:
 
         try:
             # Validate token by fetching user info
-            operation = {
-                "operationName": "CoreActionsCurrentUser",
-                "extensions": {
-                    "persistedQuery": {
-                        "version": 1,
-                        "sha256Hash": "6f1b0c8c5f0e4e4e8f0e4e4e8f0e4e4e8f0e4e4e8f0e4e4e8f0e4e4e8f0e4e4e"
-                    }
-                },
-                "variables": {}
-            }
-
-            response = await self.gql_request(operation)
+            response = await self.gql_request(GQL_OPERATIONS["CurrentUser"])
 
             if "data" in response and "currentUser" in response["data"]:
                 user_data = response["data"]["currentUser"]
@@ -201,199 +237,267 @@ class TwitchClient:
     # INVENTORY & CAMPAIGNS
     # ========================================================================
 
+    async def _timed_gql_request(self, name: str, operation: GQLOperation) -> dict:
+        start = perf_counter()
+        try:
+            return await self.gql_request(operation)
+        finally:
+            self.inventory_timings[name] = perf_counter() - start
+
     async def fetch_inventory(self):
-        """Fetch drops inventory and campaigns."""
+        """Fetch drops inventory and campaigns.
+
+        The campaigns dashboard and the inventory (drop progress and claim state)
+        are requested concurrently, and joined by drop ID.
+        """
         self.print("Fetching inventory...")
         self.update_status("Fetching inventory...")
         self.state = State.INVENTORY_FETCH
 
         try:
-            response = await self.gql_request(GQL_OPERATIONS["GetDropCampaigns"])
-
+            start = perf_counter()
+            response, inventory_response = await asyncio.gather(
+                self._timed_gql_request("dashboard", GQL_OPERATIONS["GetDropCampaigns"]),
+                self._timed_gql_request("inventory", GQL_OPERATIONS["GetInventory"]),
+                return_exceptions=True,
+            )
+            self.inventory_timings["total"] = perf_counter() - start
+            logger.info(
+                "Inventory fetch: "
+                + ", ".join(f"{name} {value * 1000:.0f}ms" for name, value in self.inventory_timings.items())
+            )
+
+            if isinstance(response, BaseException):
+                raise response
             if "data" not in response:
                 raise MinerException("Invalid inventory response")
 
             campaigns_data = response["data"].get("currentUser", {}).get("dropCampaigns", [])
 
-            self.inventory.clear()
-            self.games.clear()
-
-            for campaign_data in campaigns_data:
-                try:
-                    campaign = DropsCampaign(self, campaign_data)
-                    self.inventory.append(campaign)
-                    self.games.add(campaign.game)
-                except Exception as e:
-                    logger.error(f"Error parsing campaign: {e}")
+            # Progress from the inventory is nice to have, the dashboard alone still works
+            if isinstance(inventory_response, BaseException):
+                logger.warning(f"Inventory query failed, using the dashboard only: {inventory_response}")
+            elif "data" in inventory_response:
+                inventory_data = (inventory_response["data"].get("currentUser") or {}).get("inventory")
+                campaigns_data = merge_inventory(campaigns_data, inventory_data)
+
+            # Update the existing model in place, instead of rebuilding it
+            changes = reconcile(self, self.inventory, self.inventory_index, campaigns_data)
+            self.games = {campaign.game for campaign in self.inventory}
+            self.scheduler.apply_changes(changes, self.inventory_index)
+            self.planner.apply_changes(changes, self.inventory_index)
+            if self.settings.priority_mode == PriorityMode.MAXIMIZE_DROPS:
+                self.planner.log_plan()
+
+            if changes.removed_drops:
+                self.watchers.clear_drops(changes.removed_drops)
+            if changes:
+                self.discovery.rescore()
+                self.discovery.wake()
+                self.watchers.wake()
 
             self.print(f"Found {len(self.inventory)} campaigns")
-            self.update_inventory()
+            if changes:
+                logger.info(f"Inventory changes: {changes!r}")
+                self.update_inventory(changes)
             self.update_status(f"Loaded {len(self.inventory)} campaigns")
 
         except Exception as e:
             self.print(f"Error fetching inventory: {e}")
             raise
 
-    def get_active_campaign(self) -> Optional[DropsCampaign]:
-        """Get the currently active campaign to mine."""
-        if not self.watching_channel:
-            return None
+    @property
+    def watching_channel(self) -> Optional[Channel]:
+        """Channel of the primary watch session."""
+        return self.watchers.primary.channel
 
-        # Filter campaigns that can be earned on current channel
-        available = [c for c in self.inventory if c.can_earn(self.watching_channel)]
+    @property
+    def current_drop(self) -> Optional[TimedDrop]:
+        """Drop of the primary watch session."""
+        return self.watchers.primary.drop
 
-        if not available:
+    def get_active_campaign(self, channel: Optional[Channel] = None) -> Optional[DropsCampaign]:
+        """Get the currently active campaign to mine on the channel, the watched one by default."""
+        if channel is None:
+            channel = self.watching_channel
+        if not channel:
             return None
-
-        # Sort by priority mode
-        if self.settings.priority_mode == PriorityMode.ENDING_SOONEST:
-            available.sort(key=lambda c: c.ends_at)
-        elif self.settings.priority_mode == PriorityMode.LOW_AVAILABILITY:
-            available.sort(key=lambda c: c.availability)
-        else:  # PRIORITY_ONLY
-            # Sort by priority list
-            def priority_key(campaign):
-                try:
-                    return self.settings.priority.index(campaign.game.name)
-                except ValueError:
-                    return 999999
-            available.sort(key=priority_key)
-
-        return available[0] if available else None
+        if self.settings.priority_mode == PriorityMode.MAXIMIZE_DROPS:
+            campaign = self.planner.best(channel)
+            if campaign is not None:
+                return campaign
+        return self.scheduler.best(channel)
+
+    def pick_drop(self, campaign: DropsCampaign) -> Optional[TimedDrop]:
+        """The campaign's drop to show progress for."""
+        if self.settings.priority_mode == PriorityMode.MAXIMIZE_DROPS:
+            return self.planner.next_drop(campaign) or campaign.first_drop
+        return campaign.first_drop
+
+    def reschedule(self, campaign: DropsCampaign):
+        """Let the scheduler and the planner know a campaign's drops progressed or got claimed."""
+        self.scheduler.update(campaign)
+        self.planner.update(campaign)
 
     # ========================================================================
     # CHANNELS
     # ========================================================================
 
-    async def fetch_channels_for_game(self, game: Game, limit: int = 30) -> list[Channel]:
-        """Fetch live channels for a game."""
-        try:
-            operation = GQL_OPERATIONS["GetDirectory"].copy()
-            operation["variables"]["slug"] = game.slug
-            operation["variables"]["limit"] = limit
-
-            response = await self.gql_request(operation)
-
-            if "data" not in response or "game" not in response["data"]:
-                return []
-
-            game_data = response["data"]["game"]
-            if not game_data or "streams" not in game_data:
-                return []
-
-            channels = []
-            for edge in game_data["streams"]["edges"]:
+    async def iter_channels_for_game(
+        self, game: Game, page_size: int = DIRECTORY_PAGE_SIZE, max_pages: int = DIRECTORY_MAX_PAGES
+    ) -> AsyncIterator[Channel]:
+        """Yield the live channels of a game page by page, following the directory cursor.
+
+        Pages are only requested as the caller keeps iterating, so breaking out early
+        saves the requests for the remaining ones. At most `max_pages` pages are read.
+        Request errors are raised, so that a failed fetch isn't mistaken for an empty directory.
+        """
+        cursor: Optional[str] = None
+        for _ in range(max_pages):
+            variables = {"slug": game.slug, "limit": page_size}
+            if cursor is not None:
+                # The first page keeps the same variables as a plain fetch, so they share the cache
+                variables["cursor"] = cursor
+            response = await self.gql_request(GQL_OPERATIONS["GetDirectory"].with_variables(variables))
+            game_data = (response.get("data") or {}).get("game")
+            if not game_data or not game_data.get("streams"):
+                return
+            streams = game_data["streams"]
+
+            for edge in streams.get("edges") or []:
+                cursor = edge.get("cursor") or cursor
                 node = edge["node"]
                 if node and node.get("broadcaster"):
-                    channel = Channel.from_directory(self, node)
-                    channels.append(channel)
-                    self.channels[channel.login] = channel
+                    yield self._channel_from_directory(node)
 
-            return channels
+            if not (streams.get("pageInfo") or {}).get("hasNextPage") or cursor is None:
+                return
 
+    def _channel_from_directory(self, node: dict) -> Channel:
+        """The channel of a directory node, updating the known object instead of creating another one."""
+        channel = self.channels.get(int(node["broadcaster"]["id"]))
+        if channel is None:
+            channel = Channel.from_directory(self, node)
+            self.channels[channel.id] = channel
+        else:
+            channel.update_from_directory(node)
+        return channel
+
+    def prune_channels(self):
+        """Forget channels that no directory listing, watch session or subscription refers to anymore."""
+        keep = {channel.id for directory in self.discovery.table.values() for channel in directory.channels}
+        keep.update(session.channel.id for session in self.watchers.sessions if session.channel)
+        if self.websocket_pool is not None:
+            keep.update(self.websocket_pool.channel_ids)
+        for channel_id in self.channels.keys() - keep:
+            del self.channels[channel_id]
+
+    async def fetch_channels_for_game(self, game: Game, limit: int = DIRECTORY_PAGE_SIZE) -> list[Channel]:
+        """Fetch the first page of live channels for a game."""
+        return [channel async for channel in self.iter_channels_for_game(game, page_size=limit, max_pages=1)]
+
+    async def find_channel(self, campaign: DropsCampaign) -> Optional[Channel]:
+        """Walk the game's directory until a channel the campaign can be earned on shows up."""
+        scanned = 0
+        try:
+            async for channel in self.iter_channels_for_game(campaign.game):
+                scanned += 1
+                if campaign.can_earn(channel):
+                    logger.debug(f"Found {channel.login} for {campaign.name} after {scanned} channels")
+                    return channel
         except Exception as e:
-            logger.error(f"Error fetching channels for {game.name}: {e}")
-            return []
-
-    async def select_channel(self) -> Optional[Channel]:
-        """Select best channel to watch."""
-        campaign = self.get_active_campaign()
+            logger.error(f"Error fetching channels for {campaign.game.name}: {e}")
+        return None
+
+    async def select_channel(self, exclude_games: Iterable[int] = ()) -> Optional[Channel]:
+        """Select best channel to watch, for a game other than the excluded ones."""
+        campaign = None
+        if self.settings.priority_mode == PriorityMode.MAXIMIZE_DROPS:
+            campaign = self.planner.next_campaign(exclude_games)
+        if campaign is None:
+            # Also when nothing left in the plan can make its deadline, there's still progress to make
+            campaign = self.scheduler.next_campaign(exclude_games)
 
         if not campaign:
             self.print("No active campaigns available")
             return None
 
         self.print(f"Looking for channels for: {campaign.game.name}")
-        channels = await self.fetch_channels_for_game(campaign.game)
+        # Usually already in the discovery table, fetched only if it isn't
+        channels = await self.discovery.channels(campaign.game)
 
         if not channels:
             self.print(f"No live channels found for {campaign.game.name}")
             return None
 
-        # Sort by viewer count (descending)
-        channels.sort(key=lambda c: c.viewers, reverse=True)
-
-        return channels[0]
-
-    async def switch_channel(self, channel: Optional[Channel] = None):
-        """Switch to a different channel."""
+        # Prefer channels that progress the most campaigns of the game at once,
+        # discovery keeps the scorer's snapshot in sync with the table
+        best = self.scorer.best(campaign.game)
+        channel = best[0] if best else None
+        if channel is None and campaign.allowed_channels:
+            # Channels the campaign is restricted to are often further down the directory
+            channel = await self.find_channel(campaign)
         if channel is None:
-            channel = await self.select_channel()
+            self.print(f"No live channels for {campaign.game.name} can earn drops")
+        return channel
 
-        if channel is None:
-            self.watching_channel = None
-            self.update_channel("None")
-            self.update_drop(None)
+    async def sync_channel_topics(self):
+        """Follow the stream state of the watched channels, and of the best backups for their games."""
+        if self.websocket_pool is None:
             return
+        watched = [session.channel for session in self.watchers.sessions if session.channel]
+        channels = list(watched)
+        for channel in watched:
+            if channel.game is not None:
+                channels.extend(self.scorer.best(channel.game, CHANNEL_BACKUPS + 1))
+        self.discovery.covered = {channel.game.id for channel in watched if channel.game is not None}
+        try:
+            await self.websocket_pool.watch_channels(channels)
+        except Exception as e:
+            logger.error(f"Error updating channel topics: {e}")
 
-        self.watching_channel = channel
-        self.update_channel(channel.display_name)
-        self.print(f"Watching: {channel.display_name} ({channel.game.name})")
-
-        # Update current drop
-        campaign = self.get_active_campaign()
-        if campaign:
-            self.current_drop = campaign.first_drop
-            self.update_drop(self.current_drop)
+    async def switch_channel(self, channel: Optional[Channel] = None):
+        """Switch the primary watch session to a different channel."""
+        await self.watchers.switch(self.watchers.primary, channel)
 
     # ========================================================================
     # WATCHING & MINING
     # ========================================================================
 
-    async def send_watch(self) -> bool:
+    async def send_watch(self, channel: Optional[Channel] = None) -> bool:
         """Send watch event to progress drops."""
-        if not self.watching_channel:
+        if channel is None:
+            channel = self.watching_channel
+        if not channel:
             return False
 
         try:
-            # Simulate watching by sending minute watched
-            # In real implementation, this would send proper spade events
-            return True
+            return await self.heartbeat.beat(channel)
         except Exception as e:
             logger.error(f"Error sending watch: {e}")
             return False
 
-    async def watch_loop(self):
-        """Main watching loop."""
-        while self._running:
-            try:
-                if self.watching_channel and self.current_drop:
-                    success = await self.send_watch()
-
-                    if success:
-                        # Update progress (simulated)
-                        if self.current_drop:
-                            self.current_drop.current_minutes += 1
-                            self.update_drop(self.current_drop)
-
-                            # Check if drop is complete
-                            if self.current_drop.is_complete:
-                                await self.claim_drop(self.current_drop)
-                                await self.switch_channel()
-
-                await asyncio.sleep(WATCH_INTERVAL.total_seconds())
-
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                logger.error(f"Error in watch loop: {e}")
-                await asyncio.sleep(5)
-
     async def claim_drop(self, drop: TimedDrop):
         """Claim a completed drop."""
-        if not drop.claim_id:
+        if not drop.claim_id or drop.is_claimed:
             return
 
         try:
             self.print(f"Claiming drop: {drop.name}")
 
-            operation = GQL_OPERATIONS["ClaimDrop"].copy()
-            operation["variables"]["input"]["dropInstanceID"] = drop.claim_id
+            operation = GQL_OPERATIONS["ClaimDrop"].with_variables({
+                "input": {"dropInstanceID": drop.claim_id}
+            })
 
+            # Concurrent claims of the same dropInstanceID share a single request,
+            # only the first caller to see the result reports it
             response = await self.gql_request(operation)
 
-            if "data" in response:
-                drop.is_claimed = True
+            if "data" in response and not drop.is_claimed:
+                unlocked = drop.mark_claimed()
+                if unlocked:
+                    logger.info(f"Claiming {drop.name} unlocked: {', '.join(unlocked)}")
+                self.reschedule(drop.campaign)
                 self.print(f"✓ Claimed: {drop.name}")
                 self.notify("Drop Claimed", f"{drop.name}\n{drop.campaign.game.name}")
 
@@ -413,6 +517,10 @@ class TwitchClient:
         self.print("Starting TwitchDropsMiner...")
 
         try:
+            # Proxies may have been changed in settings since the last run
+            self.proxy_pool.update(ProxyPool.parse(self.settings.proxy))
+            self.proxy_pool.start()
+
             # Login
             if not self.is_logged_in():
                 await self.login()
@@ -424,11 +532,11 @@ class TwitchClient:
             self.websocket_pool = WebsocketPool(self)
             await self.websocket_pool.start()
 
-            # Select initial channel
-            await self.switch_channel()
+            # Keep the directories of every game fetched in the background
+            self.discovery.start()
 
-            # Start watch loop
-            self._watch_task = asyncio.create_task(self.watch_loop())
+            # Select initial channels and start watching
+            await self.watchers.start()
 
             self.print("Miner started successfully")
             self.update_status("Running")
@@ -449,23 +557,29 @@ class TwitchClient:
         self.update_status("Stopping...")
 
         # Cancel tasks
-        if self._watch_task:
-            self._watch_task.cancel()
-            try:
-                await self._watch_task
-            except asyncio.CancelledError:
-                pass
+        await self.watchers.stop()
+        await self.discovery.stop()
+        logger.info(f"Heartbeat stats: {self.heartbeat.stats()}")
 
         # Stop websocket
         if self.websocket_pool:
             await self.websocket_pool.stop()
 
+        await self.proxy_pool.stop()
+
         # Close session
         await self.close_session()
 
         self.print("Miner stopped")
         self.update_status("Stopped")
 
+    async def shutdown(self):
+        """Stop the miner and release the connection pool."""
+        await self.stop()
+        await self.close_session()
+        logger.info(f"Connection pool stats: {self.connection_pool.stats()}")
+        await self.connection_pool.close()
+
     async def restart(self):
         """Restart the miner."""
         await self.stop()
@@ -1,11 +1,13 @@
 """Utility functions and classes"""
-import json
 import random
 import string
 import asyncio
 from datetime import datetime, timezone
+from time import monotonic
 from typing import TypeVar, Generic
 
+from core import codec
+
 _T = TypeVar("_T")
 
 
@@ -21,7 +23,7 @@ def timestamp(time_str: str) -> datetime:
 
 def json_minify(data: dict | list) -> str:
     """Returns minified JSON for payload usage."""
-    return json.dumps(data, separators=(',', ':'))
+    return codec.dumps(data)
 
 
 class AwaitableValue(Generic[_T]):
@@ -54,11 +56,18 @@ class AwaitableValue(Generic[_T]):
 
 
 class ExponentialBackoff:
-    """Exponential backoff iterator for retries."""
-    def __init__(self, base: float = 1.0, maximum: float = 60.0, multiplier: float = 2.0):
+    """Exponential backoff iterator for retries.
+
+    With `jitter` set, each delay is randomly shortened by up to that fraction of itself,
+    so that clients failing at the same time don't all retry at the same time.
+    """
+    def __init__(
+        self, base: float = 1.0, maximum: float = 60.0, multiplier: float = 2.0, jitter: float = 0.0
+    ):
         self.base = base
         self.maximum = maximum
         self.multiplier = multiplier
+        self.jitter = jitter
         self._current = base
 
     def __iter__(self):
@@ -67,12 +76,89 @@ class ExponentialBackoff:
     def __next__(self) -> float:
         value = self._current
         self._current = min(self._current * self.multiplier, self.maximum)
+        if self.jitter:
+            value -= random.uniform(0, value * self.jitter)
         return value
 
     def reset(self):
         self._current = self.base
 
 
+class CircuitBreaker:
+    """Stops everyone from retrying a failing dependency, until a single probe gets through.
+
+    After `threshold` failures in a row the breaker opens, and `wait` holds callers back.
+    Every `probe_interval`, one caller is let through to try, and its first success closes
+    the breaker for everyone.
+    """
+    def __init__(self, threshold: int, probe_interval: float):
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self.failures = 0
+        self.trips = 0
+        self._next_probe = 0.0
+        self._closed = asyncio.Event()
+        self._closed.set()
+
+    @property
+    def is_open(self) -> bool:
+        return not self._closed.is_set()
+
+    def record_success(self):
+        self.failures = 0
+        self._closed.set()
+
+    def record_failure(self):
+        self.failures += 1
+        if self.is_open:
+            # The probe failed, wait out another interval
+            self._next_probe = monotonic() + self.probe_interval
+        elif self.failures >= self.threshold:
+            self.trips += 1
+            self._next_probe = monotonic() + self.probe_interval
+            self._closed.clear()
+
+    async def wait(self):
+        """Return right away while closed, otherwise once the breaker closes or it's this caller's turn to probe."""
+        while self.is_open:
+            remaining = self._next_probe - monotonic()
+            if remaining <= 0:
+                # One probe per interval, even if this one never reports back
+                self._next_probe = monotonic() + self.probe_interval
+                return
+            try:
+                await asyncio.wait_for(self._closed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+
+class TokenBucket:
+    """Token bucket rate limiter, allowing bursts of up to `capacity` acquisitions."""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Block all acquisitions for the given time, e.g. when told to back off by the server."""
+        self._paused_until = max(self._paused_until, monotonic() + seconds)
+
+    async def acquire(self):
+        while True:
+            now = monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
 class Game:
     """Represents a Twitch game."""
     def __init__(self, data: dict):
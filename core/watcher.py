@@ -0,0 +1,197 @@
+"""Concurrent watch sessions"""
+import asyncio
+import logging
+from typing import Optional, TYPE_CHECKING
+
+from core.constants import WATCH_MAX_FAILURES
+
+if TYPE_CHECKING:
+    from core.channel import Channel
+    from core.inventory import TimedDrop
+    from core.twitch_client import TwitchClient
+
+logger = logging.getLogger("TwitchDrops.watcher")
+
+
+class WatchSession:
+    """One channel being watched, and the drop it's shown to progress."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.channel: Optional['Channel'] = None
+        self.drop: Optional['TimedDrop'] = None
+        self.task: Optional[asyncio.Task] = None
+        # Beacons in a row that weren't accepted for the current channel
+        self.failures = 0
+        # WatcherPool.generation when the session last looked for a channel
+        self.tried_generation = 0
+
+    @property
+    def game_id(self) -> Optional[int]:
+        if self.channel is None or self.channel.game is None:
+            return None
+        return self.channel.game.id
+
+    def __repr__(self):
+        return f"WatchSession({self.index}, {self.channel!r}, {self.drop!r})"
+
+
+class WatcherPool:
+    """Runs several watch sessions at once, each on a different game.
+
+    Watching a channel progresses every campaign of its game that can be earned there,
+    so keeping sessions on different games is what guarantees that no two of them work
+    on the same campaign. Sessions pick their channel one at a time, under a lock,
+    skipping the games the other sessions are on.
+    """
+
+    def __init__(self, twitch: 'TwitchClient', size: int = 2):
+        self._twitch = twitch
+        self.sessions: list[WatchSession] = []
+        self._lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+        # Bumped when what there is to watch may have changed, for idle sessions to look again
+        self.generation = 0
+        self.resize(size)
+
+    def resize(self, size: int):
+        """Set the number of sessions, only while stopped."""
+        self.sessions = [WatchSession(i) for i in range(max(1, size))]
+
+    @property
+    def primary(self) -> WatchSession:
+        """The session shown as the current channel and drop."""
+        return self.sessions[0]
+
+    def wake(self):
+        """Let idle sessions look for a channel again, after the inventory or a directory changed."""
+        self.generation += 1
+
+    def busy_games(self, session: WatchSession) -> set[int]:
+        return {
+            other.game_id for other in self.sessions
+            if other is not session and other.game_id is not None
+        }
+
+    def _update_ui(self):
+        channels = [session.channel.display_name for session in self.sessions if session.channel]
+        self._twitch.update_channel(", ".join(channels) if channels else "None")
+        self._twitch.update_drop(self.primary.drop)
+
+    async def _assign(self, session: WatchSession, channel: Optional['Channel']):
+        if channel is None:
+            channel = await self._twitch.select_channel(exclude_games=self.busy_games(session))
+        session.channel = channel
+        session.drop = None
+        session.failures = 0
+        session.tried_generation = self.generation
+        if channel is not None:
+            self._twitch.print(f"Watching: {channel.display_name} ({channel.game.name})")
+            campaign = self._twitch.get_active_campaign(channel)
+            if campaign is not None:
+                session.drop = self._twitch.pick_drop(campaign)
+
+    async def switch(self, session: WatchSession, channel: Optional['Channel'] = None):
+        """Move a session to the given channel, or to the best one for a game no other session is on.
+
+        Idle sessions get another try afterwards, since the switch may have freed up a game.
+        """
+        async with self._lock:
+            await self._assign(session, channel)
+            for other in self.sessions:
+                if other is not session and other.channel is None:
+                    await self._assign(other, None)
+            self._update_ui()
+        await self._twitch.sync_channel_topics()
+
+    def channel_changed(self, channel: 'Channel'):
+        """Switch away right away from a watched channel that went offline or to another game."""
+        for session in self.sessions:
+            if session.channel is None or session.channel.id != channel.id:
+                continue
+            if channel.online and self._twitch.get_active_campaign(channel) is not None:
+                continue
+            logger.info(f"Switching away from {channel.login}")
+            self._switch_later(session)
+
+    def _switch_later(self, session: WatchSession):
+        task = asyncio.create_task(self.switch(session))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def clear_drops(self, drop_ids: set[str]):
+        """Move sessions off drops that are gone from the inventory.
+
+        A session stays on its channel if another campaign can be earned there,
+        otherwise it switches to another channel.
+        """
+        for session in self.sessions:
+            if session.drop is None or session.drop.id not in drop_ids:
+                continue
+            campaign = self._twitch.get_active_campaign(session.channel) if session.channel else None
+            session.drop = self._twitch.pick_drop(campaign) if campaign is not None else None
+            if session.drop is None:
+                self._switch_later(session)
+        self._update_ui()
+
+    async def _watch(self, session: WatchSession):
+        twitch = self._twitch
+        while True:
+            try:
+                if session.channel and session.drop:
+                    success = await twitch.send_watch(session.channel)
+
+                    if success:
+                        session.failures = 0
+                        # Count the minute locally, drop progress events correct it
+                        drop = session.drop
+                        drop.current_minutes += 1
+                        twitch.reschedule(drop.campaign)
+                        if session is self.primary:
+                            twitch.update_drop(drop)
+
+                        # Check if drop is complete
+                        if drop.is_complete:
+                            await twitch.claim_drop(drop)
+                            await self.switch(session)
+                    else:
+                        session.failures += 1
+                        if session.failures >= WATCH_MAX_FAILURES:
+                            channel = session.channel
+                            logger.warning(
+                                f"{session.failures} watch beacons failed for {channel.login}, switching away"
+                            )
+                            # Out of selection until a directory listing shows it live again
+                            channel.online = False
+                            twitch.invalidate_channel(channel)
+                            if channel.game is not None:
+                                twitch.discovery.expire(channel.game)
+                            await self.switch(session)
+                elif session.channel is None and session.tried_generation != self.generation:
+                    # Nothing was watchable last time, but something changed since
+                    await self.switch(session)
+
+                await twitch.heartbeat.wait_tick()
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error in watch session {session.index}: {e}")
+                await asyncio.sleep(5)
+
+    async def start(self):
+        # The session count may have been changed in settings since the last run
+        self.resize(self._twitch.settings.watch_sessions)
+        await self.switch(self.primary)
+        for session in self.sessions:
+            session.task = asyncio.create_task(self._watch(session))
+
+    async def stop(self):
+        tasks = [session.task for session in self.sessions if session.task] + list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for session in self.sessions:
+            session.task = None
+            session.channel = None
+            session.drop = None
@@ -1,22 +1,117 @@
 """Websocket client for Twitch PubSub"""
 import asyncio
-import json
 import logging
-from time import time
-from typing import Optional, TYPE_CHECKING
+import random
+import zlib
+from collections import deque
+from time import time, monotonic, perf_counter
+from functools import partial
+from typing import Optional, Callable, Iterable, TYPE_CHECKING
 
 import aiohttp
 
-from core.constants import WS_URL, PING_INTERVAL, PING_TIMEOUT, MAX_WEBSOCKETS, WS_TOPICS_LIMIT
-from core.utils import create_nonce
+from core import codec
+from core.constants import (
+    WS_URL, PING_INTERVAL, PING_TIMEOUT, MAX_WEBSOCKETS, WS_TOPICS_LIMIT, WEBSOCKET_TOPICS,
+    PUBSUB_WORKERS, PUBSUB_QUEUE_SIZE, PUBSUB_LATENCY_SAMPLES, WS_RECONNECT_BACKOFF, WS_RECONNECT_JITTER,
+    WS_STABLE_AFTER, WS_RECONNECT_STAGGER, WS_BREAKER_THRESHOLD, WS_BREAKER_PROBE_INTERVAL
+)
+from core.utils import create_nonce, Game, ExponentialBackoff, CircuitBreaker
 from core.exceptions import WebsocketClosed
 
 if TYPE_CHECKING:
+    from core.channel import Channel
     from core.twitch_client import TwitchClient
 
 logger = logging.getLogger("TwitchDrops.websocket")
 
 
+class TopicDispatcher:
+    """Runs topic handlers on worker tasks, off the websocket receive loops.
+
+    Each topic always goes to the same worker, so its messages are handled in the order
+    they arrived, while different topics proceed in parallel. Worker queues are bounded:
+    when one is full, the receive loop waits for room instead of buffering without limit.
+    """
+
+    def __init__(self, workers: int = PUBSUB_WORKERS, queue_size: int = PUBSUB_QUEUE_SIZE):
+        self._queues: list[asyncio.Queue] = [asyncio.Queue(queue_size) for _ in range(workers)]
+        self._workers: list[asyncio.Task] = []
+
+        # Stats
+        self.dispatched = 0
+        self.backpressure_waits = 0
+        self._backed_up = False
+        self.max_depth = 0
+        self._latencies: deque[float] = deque(maxlen=PUBSUB_LATENCY_SAMPLES)
+        self._waits: deque[float] = deque(maxlen=PUBSUB_LATENCY_SAMPLES)
+
+    def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._work(queue)) for queue in self._queues]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        for queue in self._queues:
+            while not queue.empty():
+                queue.get_nowait()
+
+    async def submit(self, topic: str, handler: Callable, message: str):
+        """Queue a message for its topic's worker, waiting only if that worker is backed up."""
+        queue = self._queues[zlib.crc32(topic.encode()) % len(self._queues)]
+        item = (topic, handler, message, perf_counter())
+        if queue.full():
+            self.backpressure_waits += 1
+            if not self._backed_up:
+                # Once per episode, not for every message that has to wait
+                self._backed_up = True
+                logger.warning(f"PubSub dispatch queue full, {self.depth} messages waiting")
+            await queue.put(item)
+        else:
+            self._backed_up = False
+            queue.put_nowait(item)
+        self.dispatched += 1
+        self.max_depth = max(self.max_depth, queue.qsize())
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            topic, handler, message, queued_at = await queue.get()
+            start = perf_counter()
+            self._waits.append(start - queued_at)
+            try:
+                await handler(codec.loads(message))
+            except Exception as e:
+                logger.error(f"Error handling topic {topic}: {e}")
+            finally:
+                self._latencies.append(perf_counter() - start)
+                queue.task_done()
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    @staticmethod
+    def _percentile(samples: Iterable[float], fraction: float) -> float:
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def stats(self) -> dict:
+        return {
+            "dispatched": self.dispatched,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "backpressure_waits": self.backpressure_waits,
+            "wait_p50_ms": round(self._percentile(self._waits, 0.5) * 1000, 1),
+            "handler_p50_ms": round(self._percentile(self._latencies, 0.5) * 1000, 1),
+            "handler_p95_ms": round(self._percentile(self._latencies, 0.95) * 1000, 1),
+        }
+
+
 class Websocket:
     """Single websocket connection."""
 
@@ -31,9 +126,25 @@ class Websocket:
 
         self.topics: dict[str, any] = {}
 
-        # Ping tracking
-        self._next_ping = time()
-        self._max_pong = self._next_ping + PING_TIMEOUT.total_seconds()
+        # Set by the PONG answering the last PING
+        self._pong = asyncio.Event()
+        self.latency: Optional[float] = None
+
+        self._backoff = ExponentialBackoff(
+            base=WS_RECONNECT_BACKOFF[0].total_seconds(),
+            maximum=WS_RECONNECT_BACKOFF[1].total_seconds(),
+            jitter=WS_RECONNECT_JITTER,
+        )
+        # Set when the server asked for the reconnect, which isn't a failure
+        self._reconnect_requested = False
+        # When the last connection was lost, and the nonce of the LISTEN that restores its topics
+        self._disconnected_at: Optional[float] = None
+        self._resubscribe_nonce: Optional[str] = None
+
+        # Stats
+        self.reconnects = 0
+        self.downtime = 0.0
+        self.resubscribe_times: deque[float] = deque(maxlen=PUBSUB_LATENCY_SAMPLES)
 
     @property
     def connected(self) -> bool:
@@ -64,72 +175,130 @@ class Websocket:
             except asyncio.CancelledError:
                 pass
 
+    def _stagger(self) -> float:
+        """Extra delay for this socket, so the pool's sockets don't all reconnect at the same moment."""
+        step = WS_RECONNECT_STAGGER.total_seconds()
+        return self._idx * step + random.uniform(0, step)
+
+    def _connected(self, now: float):
+        if self._disconnected_at is not None:
+            self.reconnects += 1
+            self.downtime += now - self._disconnected_at
+            logger.info(f"Websocket[{self._idx}] reconnected after {now - self._disconnected_at:.1f}s")
+        else:
+            logger.info(f"Websocket[{self._idx}] connected")
+
     async def _handle(self):
         """Main websocket handler."""
         session = await self._twitch.get_session()
+        breaker: CircuitBreaker = self._pool.breaker
 
         while self._running:
+            was_open = breaker.is_open
+            # Parked while the network is down, until a probe gets through
+            await breaker.wait()
+            if was_open and not breaker.is_open:
+                await asyncio.sleep(self._stagger())
+
+            proxy = self._twitch.proxy_pool.select()
+            connected_at = None
             try:
-                async with session.ws_connect(WS_URL) as ws:
+                start = time()
+                async with session.ws_connect(WS_URL, proxy=proxy) as ws:
+                    self._twitch.proxy_pool.report(proxy, time() - start)
+                    breaker.record_success()
+                    connected_at = monotonic()
+                    self._connected(connected_at)
                     self._ws = ws
-                    logger.info(f"Websocket[{self._idx}] connected")
+                    self._reconnect_requested = False
 
                     # Subscribe to topics
                     await self._subscribe_topics()
 
-                    # Main loop
-                    while self._running and not ws.closed:
-                        # Check ping
-                        now = time()
-                        if now >= self._next_ping:
-                            await self._send_ping()
-                            self._next_ping = now + PING_INTERVAL.total_seconds()
-                            self._max_pong = now + PING_TIMEOUT.total_seconds()
-
-                        # Check pong timeout
-                        if now >= self._max_pong:
-                            logger.warning(f"Websocket[{self._idx}] pong timeout")
-                            break
-
-                        # Receive messages
-                        try:
-                            msg = await asyncio.wait_for(ws.receive(), timeout=0.5)
+                    # Pings run on their own timer, so receiving only wakes up for messages
+                    ping_task = asyncio.create_task(self._ping_loop(ws))
+                    try:
+                        while self._running:
+                            msg = await ws.receive()
 
                             if msg.type == aiohttp.WSMsgType.TEXT:
-                                await self._handle_message(json.loads(msg.data))
-                            elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED):
+                                await self._handle_message(codec.loads(msg.data))
+                            elif msg.type in (
+                                aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSING,
+                                aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR,
+                            ):
                                 break
+                    finally:
+                        ping_task.cancel()
 
-                        except asyncio.TimeoutError:
-                            continue
-
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if connected_at is None:
+                    self._twitch.proxy_pool.report(proxy, None)
+                    breaker.record_failure()
+                logger.error(f"Websocket[{self._idx}] error: {e}")
             except Exception as e:
                 logger.error(f"Websocket[{self._idx}] error: {e}")
 
-            if self._running:
-                await asyncio.sleep(5)  # Reconnect delay
+            if not self._running:
+                break
+            now = monotonic()
+            if connected_at is not None:
+                self._disconnected_at = now
+                if now - connected_at >= WS_STABLE_AFTER.total_seconds():
+                    self._backoff.reset()
+            if self._reconnect_requested:
+                # Planned by the server: no backoff, only spread out across the pool
+                delay = self._stagger()
+            else:
+                delay = next(self._backoff) + self._stagger()
+            logger.debug(f"Websocket[{self._idx}] reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
 
     async def _send_ping(self):
         """Send PING message."""
         if self._ws and not self._ws.closed:
-            await self._ws.send_json({"type": "PING"})
+            await self._ws.send_json({"type": "PING"}, dumps=codec.dumps)
             logger.debug(f"Websocket[{self._idx}] sent PING")
 
-    async def _subscribe_topics(self):
-        """Subscribe to topics."""
-        if not self.topics or not self._ws:
-            return
-
+    async def _ping_loop(self, ws: aiohttp.ClientWebSocketResponse):
+        """PING every interval, and close the connection if the PONG doesn't come in time."""
+        while not ws.closed:
+            await asyncio.sleep(PING_INTERVAL.total_seconds())
+            self._pong.clear()
+            start = time()
+            await self._send_ping()
+            try:
+                await asyncio.wait_for(self._pong.wait(), timeout=PING_TIMEOUT.total_seconds())
+            except asyncio.TimeoutError:
+                logger.warning(f"Websocket[{self._idx}] pong timeout")
+                # Ends the receive loop, which then reconnects
+                await ws.close()
+                return
+            self.latency = time() - start
+
+    async def _send_topics(self, message_type: str, topics: list[str]) -> str:
+        """Send a LISTEN or UNLISTEN message for the topics, returning its nonce."""
+        nonce = create_nonce("abcdefghijklmnopqrstuvwxyz", 30)
         message = {
-            "type": "LISTEN",
-            "nonce": create_nonce("abcdefghijklmnopqrstuvwxyz", 30),
+            "type": message_type,
+            "nonce": nonce,
             "data": {
-                "topics": list(self.topics.keys()),
+                "topics": topics,
                 "auth_token": self._twitch.settings.oauth_token
             }
         }
+        await self._ws.send_json(message, dumps=codec.dumps)
+        return nonce
+
+    async def _subscribe_topics(self):
+        """Subscribe to topics."""
+        if not self.topics or not self._ws:
+            return
 
-        await self._ws.send_json(message)
+        nonce = await self._send_topics("LISTEN", list(self.topics.keys()))
+        if self._disconnected_at is not None:
+            # Timed until the server confirms it
+            self._resubscribe_nonce = nonce
         logger.info(f"Websocket[{self._idx}] subscribed to {len(self.topics)} topics")
 
     async def _handle_message(self, message: dict):
@@ -137,7 +306,7 @@ class Websocket:
         msg_type = message.get("type")
 
         if msg_type == "PONG":
-            self._max_pong = self._next_ping
+            self._pong.set()
             logger.debug(f"Websocket[{self._idx}] received PONG")
 
         elif msg_type == "MESSAGE":
@@ -145,19 +314,20 @@ class Websocket:
             topic = data.get("topic")
 
             if topic in self.topics:
-                try:
-                    payload = json.loads(data.get("message", "{}"))
-                    await self.topics[topic](payload)
-                except Exception as e:
-                    logger.error(f"Error handling topic {topic}: {e}")
+                # Handlers may do network I/O, they must not hold up receiving
+                await self._pool.dispatcher.submit(topic, self.topics[topic], data.get("message", "{}"))
 
         elif msg_type == "RESPONSE":
             error = message.get("error")
             if error:
                 logger.error(f"Websocket[{self._idx}] error response: {error}")
+            elif self._resubscribe_nonce is not None and message.get("nonce") == self._resubscribe_nonce:
+                self._resubscribe_nonce = None
+                self.resubscribe_times.append(monotonic() - self._disconnected_at)
 
         elif msg_type == "RECONNECT":
             logger.warning(f"Websocket[{self._idx}] reconnect requested")
+            self._reconnect_requested = True
             if self._ws:
                 await self._ws.close()
 
@@ -165,14 +335,44 @@ class Websocket:
         """Add a topic to subscribe to."""
         self.topics[topic] = handler
 
+    async def listen(self, topics: dict[str, Callable]):
+        """Add topics, subscribing to them right away if connected."""
+        self.topics.update(topics)
+        if self.connected and topics:
+            await self._send_topics("LISTEN", list(topics))
+
+    async def unlisten(self, topics: list[str]):
+        """Remove topics, unsubscribing from them right away if connected."""
+        for topic in topics:
+            self.topics.pop(topic, None)
+        if self.connected and topics:
+            await self._send_topics("UNLISTEN", topics)
+
 
 class WebsocketPool:
-    """Pool of websocket connections."""
+    """Pool of websocket connections.
+
+    Topics are spread over up to MAX_WEBSOCKETS connections of at most WS_TOPICS_LIMIT
+    topics each. Connections are opened when the existing ones are full, and closed once
+    their last topic is removed. Topic changes are sent to the live connection as they happen.
+    """
 
     def __init__(self, twitch: 'TwitchClient'):
         self._twitch = twitch
         self.websockets: list[Websocket] = []
         self._running = False
+        # Topic -> the websocket it's subscribed on
+        self._topic_sockets: dict[str, Websocket] = {}
+        self.dispatcher = TopicDispatcher()
+        # Shared by all connections, so a network outage parks them together
+        self.breaker = CircuitBreaker(WS_BREAKER_THRESHOLD, WS_BREAKER_PROBE_INTERVAL.total_seconds())
+        # Connection stats of the websockets closed so far
+        self._closed_reconnects = 0
+        self._closed_downtime = 0.0
+        self._closed_resubscribe_times: deque[float] = deque(maxlen=PUBSUB_LATENCY_SAMPLES)
+        # Channels with stream state subscriptions, by ID, and their topics
+        self._channels: dict[int, 'Channel'] = {}
+        self._channel_topics: dict[int, list[str]] = {}
 
     async def start(self):
         """Start websocket pool."""
@@ -180,17 +380,14 @@ class WebsocketPool:
             return
 
         self._running = True
-
-        # Create initial websocket
-        ws = Websocket(self, 0)
-        self.websockets.append(ws)
+        self.dispatcher.start()
 
         # Add user topics
         if self._twitch.settings.user_id:
             user_id = self._twitch.settings.user_id
-            ws.add_topic(f"user-drop-events.{user_id}", self._handle_drop_event)
-
-        await ws.start()
+            await self.add_topics({
+                f"{WEBSOCKET_TOPICS['User']['Drops']}.{user_id}": self._handle_drop_event,
+            })
 
     async def stop(self):
         """Stop websocket pool."""
@@ -201,8 +398,158 @@ class WebsocketPool:
 
         for ws in self.websockets:
             await ws.stop()
+        await self.dispatcher.stop()
+        logger.info(f"PubSub dispatch stats: {self.dispatcher.stats()}")
+        logger.info(f"PubSub connection stats: {self.stats()}")
 
         self.websockets.clear()
+        self._topic_sockets.clear()
+        self._channels.clear()
+        self._channel_topics.clear()
+
+    async def _open(self) -> Optional[Websocket]:
+        """Start another connection, unless the limit is reached."""
+        if len(self.websockets) >= MAX_WEBSOCKETS:
+            return None
+        used = {ws._idx for ws in self.websockets}
+        ws = Websocket(self, min(i for i in range(MAX_WEBSOCKETS) if i not in used))
+        self.websockets.append(ws)
+        await ws.start()
+        logger.info(f"Websocket[{ws._idx}] opened, {len(self.websockets)} connections")
+        return ws
+
+    async def add_topics(self, topics: dict[str, Callable]):
+        """Subscribe to topics, filling up the open connections before opening new ones."""
+        pending = {topic: handler for topic, handler in topics.items() if topic not in self._topic_sockets}
+        for ws in list(self.websockets):
+            if not pending:
+                return
+            room = WS_TOPICS_LIMIT - len(ws.topics)
+            if room > 0:
+                await self._assign(ws, dict(list(pending.items())[:room]), pending)
+        while pending:
+            ws = await self._open()
+            if ws is None:
+                logger.error(f"Websocket topic limit reached, {len(pending)} topics left out")
+                return
+            await self._assign(ws, dict(list(pending.items())[:WS_TOPICS_LIMIT]), pending)
+
+    async def _assign(self, ws: Websocket, batch: dict[str, Callable], pending: dict[str, Callable]):
+        for topic in batch:
+            del pending[topic]
+            self._topic_sockets[topic] = ws
+        await ws.listen(batch)
+
+    async def remove_topics(self, topics: Iterable[str]):
+        """Unsubscribe from topics, closing the connections that end up with none."""
+        by_socket: dict[Websocket, list[str]] = {}
+        for topic in topics:
+            ws = self._topic_sockets.pop(topic, None)
+            if ws is not None:
+                by_socket.setdefault(ws, []).append(topic)
+        for ws, removed in by_socket.items():
+            if len(removed) >= len(ws.topics):
+                # Closing is cheaper than unsubscribing from everything first
+                ws.topics.clear()
+                self.websockets.remove(ws)
+                await ws.stop()
+                self._closed_reconnects += ws.reconnects
+                self._closed_downtime += ws.downtime
+                self._closed_resubscribe_times.extend(ws.resubscribe_times)
+                logger.info(f"Websocket[{ws._idx}] closed, {len(self.websockets)} connections")
+            else:
+                await ws.unlisten(removed)
+
+    @property
+    def topic_count(self) -> int:
+        return len(self._topic_sockets)
+
+    @property
+    def channel_ids(self) -> set[int]:
+        """IDs of the channels with stream state subscriptions."""
+        return set(self._channels)
+
+    def stats(self) -> dict:
+        resubscribes = list(self._closed_resubscribe_times)
+        resubscribes.extend(sample for ws in self.websockets for sample in ws.resubscribe_times)
+        return {
+            "connections": len(self.websockets),
+            "reconnects": self._closed_reconnects + sum(ws.reconnects for ws in self.websockets),
+            "downtime_s": round(self._closed_downtime + sum(ws.downtime for ws in self.websockets), 1),
+            "resubscribe_p50_s": round(TopicDispatcher._percentile(resubscribes, 0.5), 2),
+            "resubscribe_max_s": round(max(resubscribes, default=0.0), 2),
+            "breaker_open": self.breaker.is_open,
+            "breaker_trips": self.breaker.trips,
+        }
+
+    async def watch_channels(self, channels: Iterable['Channel']):
+        """Keep stream state subscriptions for exactly these channels, sending only the difference."""
+        if not self._running:
+            return
+        wanted = {}
+        for channel in channels:
+            wanted.setdefault(channel.id, channel)
+        self._channels = wanted
+
+        removed = []
+        for channel_id in self._channel_topics.keys() - wanted.keys():
+            removed.extend(self._channel_topics.pop(channel_id))
+        added = {}
+        for channel_id in wanted.keys() - self._channel_topics.keys():
+            topics = {
+                f"{WEBSOCKET_TOPICS['Channel']['StreamState']}.{channel_id}":
+                    partial(self._handle_stream_state, channel_id),
+                f"{WEBSOCKET_TOPICS['Channel']['StreamUpdate']}.{channel_id}":
+                    partial(self._handle_stream_update, channel_id),
+            }
+            self._channel_topics[channel_id] = list(topics)
+            added.update(topics)
+
+        if removed:
+            await self.remove_topics(removed)
+        if added:
+            await self.add_topics(added)
+        if removed or added:
+            logger.debug(f"Channel topics: +{len(added)} -{len(removed)}, {len(wanted)} channels")
+
+    async def _handle_stream_state(self, channel_id: int, payload: dict):
+        """Handle video-playback-by-id: the stream going up or down, and viewer counts."""
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            return
+        event_type = payload.get("type")
+        if event_type == "viewcount":
+            channel.viewers = payload.get("viewers", channel.viewers)
+            return
+        if event_type == "stream-down":
+            logger.info(f"{channel.login} went offline")
+            channel.online = False
+            channel.broadcast_id = None
+        elif event_type == "stream-up":
+            logger.info(f"{channel.login} went online")
+            channel.online = True
+            # Not watchable before a directory listing gives the new stream's broadcast ID
+            channel.broadcast_id = None
+            if channel.game is not None:
+                self._twitch.discovery.expire(channel.game)
+        else:
+            return
+        self._twitch.invalidate_channel(channel)
+        self._twitch.watchers.channel_changed(channel)
+
+    async def _handle_stream_update(self, channel_id: int, payload: dict):
+        """Handle broadcast-settings-update: title and game changes."""
+        channel = self._channels.get(channel_id)
+        if channel is None or payload.get("type") != "broadcast_settings_update":
+            return
+        game_id = payload.get("game_id")
+        if not game_id or (channel.game is not None and channel.game.id == int(game_id)):
+            return
+        logger.info(f"{channel.login} switched to {payload.get('game')}")
+        # The directory listing of the old game no longer holds
+        self._twitch.invalidate_channel(channel)
+        channel.game = Game({"id": str(game_id), "name": payload.get("game") or str(game_id)})
+        self._twitch.watchers.channel_changed(channel)
 
     async def _handle_drop_event(self, payload: dict):
         """Handle drop progress event."""
@@ -217,23 +564,22 @@ class WebsocketPool:
                 logger.info(f"Drop progress: {drop_id} - {current_minutes}/{required_minutes}")
 
                 # Update drop in inventory
-                for campaign in self._twitch.inventory:
-                    drop = campaign.get_drop(drop_id)
-                    if drop:
-                        drop.current_minutes = current_minutes
-                        self._twitch.update_drop(drop)
-                        break
+                drop = self._twitch.inventory_index.get_drop(drop_id)
+                if drop:
+                    drop.current_minutes = current_minutes
+                    self._twitch.reschedule(drop.campaign)
+                    self._twitch.update_drop(drop)
 
             elif event_type == "drop-claim":
                 drop_id = payload.get("drop_id")
                 logger.info(f"Drop ready to claim: {drop_id}")
 
                 # Find and claim drop
-                for campaign in self._twitch.inventory:
-                    drop = campaign.get_drop(drop_id)
-                    if drop and not drop.is_claimed:
-                        await self._twitch.claim_drop(drop)
-                        break
+                drop = self._twitch.inventory_index.get_drop(
+                    drop_id, claim_id=payload.get("drop_instance_id")
+                )
+                if drop and not drop.is_claimed:
+                    await self._twitch.claim_drop(drop)
 
         except Exception as e:
             logger.error(f"Error handling drop event: {e}")
@@ -73,6 +73,7 @@ class TwitchDropsMinerApp(MDApp):
             'on_channel': self.on_channel,
             'on_drop': self.on_drop,
             'on_inventory': self.on_inventory,
+            'on_inventory_changes': self.on_inventory_changes,
             'on_notify': self.on_notify,
         }
         self.twitch_client = TwitchClient(self.settings, callbacks)
@@ -100,14 +101,20 @@ class TwitchDropsMinerApp(MDApp):
         """Called when the application starts."""
         logger.info("TwitchDropsMiner started")
 
+        # Open connections to Twitch while the user is still looking at the UI
+        asyncio.run_coroutine_threadsafe(
+            self.twitch_client.prewarm(),
+            self.loop
+        )
+
     def on_stop(self):
         """Called when the application stops."""
         logger.info("TwitchDropsMiner stopping")
 
         # Stop twitch client
-        if self.twitch_client and self.twitch_client._running:
+        if self.twitch_client:
             asyncio.run_coroutine_threadsafe(
-                self.twitch_client.stop(),
+                self.twitch_client.shutdown(),
                 self.loop
             )
 
@@ -153,6 +160,11 @@ class TwitchDropsMinerApp(MDApp):
         inventory_screen = self.screen_manager.get_screen('inventory')
         inventory_screen.update_inventory(inventory)
 
+    def on_inventory_changes(self, inventory: list, changes):
+        """Handle incremental inventory update."""
+        inventory_screen = self.screen_manager.get_screen('inventory')
+        inventory_screen.apply_inventory_changes(inventory, changes)
+
     def on_notify(self, title: str, message: str):
         """Handle notification."""
         if platform == 'android':
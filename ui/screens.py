@@ -242,22 +242,56 @@ class InventoryScreen(BaseScreen):
 
         self.layout.add_widget(scroll)
 
+        # Campaign ID -> list item
+        self.items: dict = {}
+
+    @staticmethod
+    def _item_texts(campaign) -> dict:
+        return {
+            "text": f"{campaign.name}",
+            "secondary_text": f"{campaign.game.name}",
+            "tertiary_text": f"Progress: {campaign.claimed_drops}/{campaign.total_drops} drops ({campaign.progress:.0%})",
+        }
+
+    def _campaign_item(self, campaign) -> ThreeLineListItem:
+        return ThreeLineListItem(**self._item_texts(campaign))
+
     def update_inventory(self, inventory: list):
         """Update inventory list."""
         self.list_view.clear_widgets()
+        self.items.clear()
 
         if not inventory:
             self.list_view.add_widget(OneLineListItem(text="No campaigns available"))
             return
 
         for campaign in inventory:
-            item = ThreeLineListItem(
-                text=f"{campaign.name}",
-                secondary_text=f"{campaign.game.name}",
-                tertiary_text=f"Progress: {campaign.claimed_drops}/{campaign.total_drops} drops ({campaign.progress:.0%})"
-            )
+            item = self._campaign_item(campaign)
+            self.items[campaign.id] = item
             self.list_view.add_widget(item)
 
+    def apply_inventory_changes(self, inventory: list, changes):
+        """Update only the list items of campaigns that changed."""
+        if not self.items or not inventory:
+            self.update_inventory(inventory)
+            return
+
+        for campaign_id in changes.removed_campaigns:
+            item = self.items.pop(campaign_id, None)
+            if item is not None:
+                self.list_view.remove_widget(item)
+
+        for position, campaign in enumerate(inventory):
+            if campaign.id in changes.added_campaigns:
+                item = self._campaign_item(campaign)
+                self.items[campaign.id] = item
+                # Kivy counts the index from the end of the list
+                self.list_view.add_widget(item, index=len(self.list_view.children) - position)
+            elif campaign.id in changes.changed_campaigns:
+                item = self.items[campaign.id]
+                for name, value in self._item_texts(campaign).items():
+                    setattr(item, name, value)
+
 
 class ChannelsScreen(BaseScreen):
     """Channels screen."""